@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import hashlib
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from extract_compatibles import (
+    CACHE_DIR,
+    DEFAULT_CACHE_PATH,
+    extract_files,
+    find_yaml_files,
+    load_cache,
+    save_cache,
+)
+from find_compatible_dts import (
+    find_all_dts_files,
+    find_roots,
+    get_dts_cache_path,
+    reachable,
+    reverse_graph,
+    scan_dts_files,
+)
+
+XREF_CACHE_VERSION = 1
+
+# compatible -> defining file -> top-level .dts files
+XrefRow = Dict[str, Dict[str, List[str]]]
+
+
+def get_xref_cache_path(kernel: Path) -> Path:
+    digest = hashlib.sha1(str(kernel).encode()).hexdigest()[:16]
+    return CACHE_DIR / f'binding_dts_xref-{digest}.json'
+
+
+def get_graph_key(
+    incmap: Dict[Path, Set[Path]],
+    compatmap: Dict[Path, Set[str]],
+) -> str:
+    h = hashlib.sha1()
+    for path in sorted(incmap):
+        h.update(str(path).encode())
+        for inc in sorted(incmap[path]):
+            h.update(b'\0i' + str(inc).encode())
+        for compat in sorted(compatmap.get(path, set())):
+            h.update(b'\0c' + compat.encode())
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+class XrefGraph:
+    def __init__(
+        self,
+        incmap: Dict[Path, Set[Path]],
+        compatmap: Dict[Path, Set[str]],
+    ):
+        self.incmap = incmap
+        self.compatmap = compatmap
+        self._compat_index: Optional[Dict[str, Set[Path]]] = None
+        self._rev: Optional[Dict[Path, Set[Path]]] = None
+        self._roots: Optional[Set[Path]] = None
+        self._tops: Dict[Path, List[str]] = {}
+
+    def defining_files(self, compatible: str) -> Set[Path]:
+        if self._compat_index is None:
+            self._compat_index = {}
+            for path, compats in self.compatmap.items():
+                for c in compats:
+                    self._compat_index.setdefault(c, set()).add(path)
+        return self._compat_index.get(compatible, set())
+
+    def tops(self, path: Path) -> List[str]:
+        if path not in self._tops:
+            if self._rev is None or self._roots is None:
+                self._rev = reverse_graph(self.incmap)
+                self._roots = find_roots(self.incmap)
+            tops = reachable({path}, self._rev, self._roots)
+            self._tops[path] = sorted(map(str, tops))
+        return self._tops[path]
+
+    def row(self, compatibles: List[str]) -> XrefRow:
+        row: XrefRow = {}
+        for compatible in compatibles:
+            row[compatible] = {
+                str(path): self.tops(path)
+                for path in sorted(self.defining_files(compatible))
+            }
+        return row
+
+
+def build_xref(
+    kernel: Path,
+    bindings: List[Path],
+    use_cache: bool = True,
+    jobs: Optional[int] = None,
+) -> Dict[str, XrefRow]:
+    binding_cache_path = DEFAULT_CACHE_PATH if use_cache else None
+    binding_compats = extract_files(bindings, binding_cache_path, jobs)
+
+    dts_cache_path = get_dts_cache_path(kernel) if use_cache else None
+    files = find_all_dts_files(kernel)
+    incmap, compatmap = scan_dts_files(files, dts_cache_path)
+    graph = XrefGraph(incmap, compatmap)
+    graph_key = get_graph_key(incmap, compatmap)
+
+    xref_cache_path = get_xref_cache_path(kernel)
+    cache: Dict[str, Any] = {}
+    if use_cache:
+        cache = load_cache(xref_cache_path, XREF_CACHE_VERSION)
+
+    out: Dict[str, XrefRow] = {}
+    changed = False
+    for binding, compatibles in binding_compats.items():
+        entry = cache.get(str(binding))
+        if (
+            entry is None
+            or entry['graph'] != graph_key
+            or entry['compatibles'] != compatibles
+        ):
+            entry = {
+                'graph': graph_key,
+                'compatibles': compatibles,
+                'row': graph.row(compatibles),
+            }
+            cache[str(binding)] = entry
+            changed = True
+
+        out[str(binding)] = entry['row']
+
+    if use_cache and changed:
+        save_cache(xref_cache_path, cache, XREF_CACHE_VERSION)
+
+    return out
+
+
+def print_xref(xref: Dict[str, XrefRow]) -> None:
+    for binding, row in xref.items():
+        print(f'{binding}:')
+        for compatible, defining in row.items():
+            print(f'\t{compatible}:')
+            for path, tops in defining.items():
+                print(f'\t\t{path}:')
+                for top in tops:
+                    print(f'\t\t\t{top}')
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description='Cross-reference binding compatibles with the .dtsi '
+        'files defining them and the top-level .dts files including those'
+    )
+    parser.add_argument('kernel', help='Path to the kernel tree')
+    parser.add_argument(
+        'bindings',
+        nargs='+',
+        help='Binding files, directories or globs',
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        help='Number of parallel binding workers, defaults to the number '
+        'of CPUs',
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Print the cross-reference as JSON',
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Do not read or write the per-stage caches',
+    )
+    args = parser.parse_args()
+
+    kernel = Path(args.kernel).resolve()
+    bindings = find_yaml_files(args.bindings)
+    xref = build_xref(kernel, bindings, not args.no_cache, args.jobs)
+
+    if args.json:
+        print(json.dumps(xref, indent=4))
+    else:
+        print_xref(xref)
+
+
+if __name__ == '__main__':
+    main()
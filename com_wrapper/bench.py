@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import pty
+import random
+import resource
+import select
+import statistics
+import sys
+import time
+import tty
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from typing import Any
+
+from config import Config
+from context import Context
+from recording import is_recording, read_recording_data
+from run import enable_stats, process_input_output
+from stats import Stats
+from vterm_bindings import vterm_lib
+
+BENCH_ROWS = 50
+BENCH_COLS = 200
+
+BOOT_LOG_MESSAGES = (
+    'Booting Linux on physical CPU 0x0000000000 [0x410fd083]',
+    'Machine model: Raspberry Pi 4 Model B Rev 1.4',
+    'Memory policy: Data cache writeback',
+    'cma: Reserved 64 MiB at 0x000000003c000000',
+    'random: crng init done',
+    'mmc0: new high speed SDHC card at address aaaa',
+    'EXT4-fs (mmcblk0p2): mounted filesystem with ordered data mode',
+    'systemd[1]: Started Journal Service.',
+    '\x1b[0;32m  OK  \x1b[0m] Reached target Basic System.',
+    '\x1b[0;1;31mFAILED\x1b[0m] Failed to start Load Kernel Modules.',
+)
+
+
+def generate_boot_log(size: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    data = bytearray()
+    ts = 0.0
+    while len(data) < size:
+        ts += rng.random() / 100
+        message = rng.choice(BOOT_LOG_MESSAGES)
+        data += f'[{ts:12.6f}] {message}\r\n'.encode()
+    return bytes(data[:size])
+
+
+def make_bench_config(actions: int, regex_actions: int) -> Config:
+    action_configs: list[dict[str, Any]] = []
+    for i in range(actions):
+        action_configs.append({'type': 'match', 'value': f'bench-match-{i}'})
+    for i in range(regex_actions):
+        action_configs.append(
+            {'type': 'match_regex', 'value': rf'bench-regex-{i}: \d+'}
+        )
+
+    return Config.model_validate(
+        {
+            'write_char_delay_us': 0,
+            'program': ('true',),
+            'args': {},
+            'actions': action_configs,
+        }
+    )
+
+
+class Replayer:
+    def __init__(self, slave_fd: int, data: bytes, baud: int, chunk_len: int):
+        self.slave_fd = slave_fd
+        self.data = data
+        self.baud = baud
+        self.chunk_len = chunk_len
+
+        # (end offset, write time) of every chunk written to the PTY
+        self.chunks: list[tuple[int, int]] = []
+        self.start_ns = 0
+        self.end_ns = 0
+
+    def run(self):
+        # 8N1 framing, 10 bits on the wire for every byte
+        bytes_per_s = self.baud / 10
+        self.start_ns = time.perf_counter_ns()
+
+        offset = 0
+        while offset < len(self.data):
+            chunk = self.data[offset : offset + self.chunk_len]
+            if bytes_per_s:
+                due_ns = self.start_ns + int(offset / bytes_per_s * 1e9)
+                delay_ns = due_ns - time.perf_counter_ns()
+                if delay_ns > 0:
+                    time.sleep(delay_ns / 1e9)
+
+            # Record the chunk before writing it, so that the sink never sees
+            # its data before knowing when it was written
+            offset += len(chunk)
+            self.chunks.append((offset, time.perf_counter_ns()))
+            written = 0
+            while written < len(chunk):
+                written += os.write(self.slave_fd, chunk[written:])
+
+
+class OutputSink:
+    def __init__(self, read_fd: int, replayer: Replayer):
+        self.read_fd = read_fd
+        self.replayer = replayer
+        self.received = 0
+        self.latencies_ns: list[int] = []
+        self.last_ns = 0
+
+    def run(self):
+        next_chunk = 0
+        while True:
+            data = os.read(self.read_fd, 65536)
+            if not data:
+                break
+
+            now_ns = time.perf_counter_ns()
+            self.received += len(data)
+            self.last_ns = now_ns
+
+            chunks = self.replayer.chunks
+            while next_chunk < len(chunks):
+                end, write_ns = chunks[next_chunk]
+                if end > self.received:
+                    break
+                self.latencies_ns.append(now_ns - write_ns)
+                next_chunk += 1
+
+
+def percentile_us(values: list[int], n: int) -> float | None:
+    if len(values) < 2:
+        return None
+    return statistics.quantiles(values, n=100)[n - 1] / 1000
+
+
+def run_bench(
+    data: bytes,
+    baud: int,
+    chunk_len: int,
+    actions: int,
+    regex_actions: int,
+    log: bool,
+    with_stats: bool = False,
+) -> dict[str, Any]:
+    config = make_bench_config(actions, regex_actions)
+    stats = Stats() if with_stats else None
+
+    with TemporaryDirectory(prefix='com-bench-') as tmpdir:
+        context = Context(Path(tmpdir, 'config.json5'))
+        if log:
+            context.add_log(str(Path(tmpdir, 'log.txt')))
+        if stats is not None:
+            enable_stats(context, stats)
+
+        master_fd, slave_fd = pty.openpty()
+        tty.setraw(slave_fd)
+        stdin_r, stdin_w = os.pipe()
+        stdout_r, stdout_w = os.pipe()
+
+        vterm = vterm_lib.vterm_new(BENCH_ROWS, BENCH_COLS)
+        vterm_lib.vterm_set_utf8(vterm, 1)
+        vterm_screen = vterm_lib.vterm_obtain_screen(vterm)
+        vterm_lib.vterm_screen_reset(vterm_screen, 0)
+
+        replayer = Replayer(slave_fd, data, baud, chunk_len)
+        sink = OutputSink(stdout_r, replayer)
+
+        def replay_fn():
+            replayer.run()
+
+            # Closing the slave makes reading the master fail, which ends
+            # the loop, wait for all the data to be drained first
+            while sink.received < len(data):
+                select.select([], [], [], 0.001)
+            replayer.end_ns = time.perf_counter_ns()
+            os.close(slave_fd)
+
+        replay_t = Thread(target=replay_fn, name='bench-replay')
+        sink_t = Thread(target=sink.run, name='bench-sink')
+
+        usage_start = resource.getrusage(resource.RUSAGE_SELF)
+        sink_t.start()
+        replay_t.start()
+
+        process_input_output(
+            config,
+            context,
+            stdin_r,
+            stdout_w,
+            master_fd,
+            vterm,
+            vterm_screen,
+            stats,
+        )
+
+        usage_end = resource.getrusage(resource.RUSAGE_SELF)
+        replay_t.join()
+        os.close(stdout_w)
+        sink_t.join()
+
+        context.reset_logs()
+        for fd in (master_fd, stdin_r, stdin_w, stdout_r):
+            os.close(fd)
+
+    elapsed_s = (sink.last_ns - replayer.start_ns) / 1e9
+    cpu_s = (usage_end.ru_utime - usage_start.ru_utime) + (
+        usage_end.ru_stime - usage_start.ru_stime
+    )
+
+    result: dict[str, Any] = {
+        'params': {
+            'bytes': len(data),
+            'baud': baud,
+            'chunk_len': chunk_len,
+            'actions': actions,
+            'regex_actions': regex_actions,
+            'log': log,
+            'stats': with_stats,
+        },
+        'results': {
+            'elapsed_s': elapsed_s,
+            'bytes_per_s': sink.received / elapsed_s if elapsed_s else None,
+            'chunks': len(sink.latencies_ns),
+            'latency_p50_us': percentile_us(sink.latencies_ns, 50),
+            'latency_p99_us': percentile_us(sink.latencies_ns, 99),
+            'cpu_s': cpu_s,
+            'max_rss_kib': usage_end.ru_maxrss,
+        },
+    }
+    if stats is not None:
+        result['stats'] = stats.as_dict()
+
+    return result
+
+
+def main():
+    parser = ArgumentParser(
+        description='Benchmark the com_wrapper console pipeline by replaying '
+        'a boot log through a local PTY'
+    )
+    parser.add_argument(
+        '-i',
+        '--input',
+        help='Boot log or session recording to replay, generate a boot log '
+        'if not given',
+    )
+    parser.add_argument(
+        '-s',
+        '--size',
+        type=int,
+        default=256 * 1024,
+        help='Size of the generated boot log',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed of the generated boot log',
+    )
+    parser.add_argument(
+        '-b',
+        '--baud',
+        type=int,
+        default=0,
+        help='Baud rate to replay at, 0 to replay as fast as possible',
+    )
+    parser.add_argument(
+        '--chunk-len',
+        type=int,
+        default=64,
+        help='Size of the chunks written to the PTY',
+    )
+    parser.add_argument(
+        '-n',
+        '--actions',
+        type=int,
+        default=16,
+        help='Number of match actions',
+    )
+    parser.add_argument(
+        '-r',
+        '--regex-actions',
+        type=int,
+        default=16,
+        help='Number of match_regex actions',
+    )
+    parser.add_argument(
+        '--log',
+        action='store_true',
+        help='Write a log file while benchmarking',
+    )
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        help='Enable the hot-path instrumentation and report its stats',
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='Write the JSON results to the given file instead of stdout',
+    )
+    args = parser.parse_args()
+
+    if args.input and is_recording(args.input):
+        data = read_recording_data(args.input)
+    elif args.input:
+        data = Path(args.input).read_bytes()
+    else:
+        data = generate_boot_log(args.size, args.seed)
+
+    result = run_bench(
+        data,
+        args.baud,
+        args.chunk_len,
+        args.actions,
+        args.regex_actions,
+        args.log,
+        args.stats,
+    )
+
+    output = json.dumps(result, indent=4)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,7 @@
+import hashlib
+import os
+import pickle
+from pathlib import Path
 from typing import Literal, Optional
 
 from pydantic import BaseModel, ConfigDict
@@ -6,20 +10,34 @@ from pydantic import BaseModel, ConfigDict
 # TODO: enforce error for unknown fields
 
 
+CONFIG_CACHE_DIR = (
+    Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache'))
+    / 'work-utils'
+    / 'com_wrapper'
+)
+
+
 class FrozenStrictModel(BaseModel):
-    model_config = ConfigDict(extra='forbid', frozen=True)
+    # Building the validators is deferred to the first validation, which
+    # does not happen at all when the config is loaded from the cache
+    model_config = ConfigDict(extra='forbid', frozen=True, defer_build=True)
+
+
+ServiceName = Literal['tftp', 'nfs']
 
 
 class RunWriteConfig(FrozenStrictModel):
     type: Literal['write']
     value: str
     needed_args: tuple[str, ...] | None = None
+    needed_services: tuple[ServiceName, ...] | None = None
 
 
 class RunWriteFromFileConfig(FrozenStrictModel):
     type: Literal['write_from_file']
     value: str
     needed_args: tuple[str, ...] | None = None
+    needed_services: tuple[ServiceName, ...] | None = None
 
 
 class RunSetArgConfig(FrozenStrictModel):
@@ -32,10 +50,30 @@ class AddLogConfig(FrozenStrictModel):
     type: Literal['add_log_file']
     name: str
     needed_args: tuple[str, ...] | None = None
+    max_size: int | None = None
+    max_age: float | None = None
+    keep: int | None = None
+    compress: bool = True
+    index_lines: int | None = None
+
+
+class RunStartServiceConfig(FrozenStrictModel):
+    type: Literal['start_service']
+    name: ServiceName
+
+
+class RunStopServiceConfig(FrozenStrictModel):
+    type: Literal['stop_service']
+    name: ServiceName
 
 
 RunConfig = (
-    RunWriteConfig | RunWriteFromFileConfig | RunSetArgConfig | AddLogConfig
+    RunWriteConfig
+    | RunWriteFromFileConfig
+    | RunSetArgConfig
+    | AddLogConfig
+    | RunStartServiceConfig
+    | RunStopServiceConfig
 )
 
 
@@ -43,6 +81,7 @@ class BaseMatchConfig(FrozenStrictModel):
     run: Optional[tuple[RunConfig, ...]] = None
     oneshot: Optional[bool] = None
     reset_logs: Optional[bool] = None
+    rotate_logs: Optional[bool] = None
     reset_oneshots: Optional[bool] = None
 
 
@@ -63,6 +102,8 @@ class TftpConfig(BaseMatchConfig):
     mounts: list[tuple[str, str]]
     server_ip: str
     server_port: str
+    autostart: bool = True
+    ready_timeout: float = 30
 
 
 class NfsConfig(BaseMatchConfig):
@@ -70,12 +111,55 @@ class NfsConfig(BaseMatchConfig):
     pseudo: str
     server_ip: str
     server_port: str
+    autostart: bool = True
+    ready_timeout: float = 30
+    restart: bool = True
+    persistent: bool = False
 
 
 class Config(FrozenStrictModel):
     write_char_delay_us: int
     program: tuple[str, ...]
     args: dict[str, str]
-    tftp: TftpConfig
-    nfs: NfsConfig
+    tftp: Optional[TftpConfig] = None
+    nfs: Optional[NfsConfig] = None
+    capture_attrs: bool = False
     actions: tuple[ActionConfig, ...]
+
+
+def get_config_cache_path(config_data: bytes) -> Path:
+    # Also key the cache by the schema, so that changes to it invalidate the
+    # previously validated configs
+    h = hashlib.sha256(config_data)
+    h.update(Path(__file__).read_bytes())
+    return CONFIG_CACHE_DIR / f'config-{h.hexdigest()[:32]}.pickle'
+
+
+def load_config(
+    config_path: Path,
+    use_cache: bool = True,
+) -> tuple[Config, bool]:
+    config_data = config_path.read_bytes()
+    cache_path = get_config_cache_path(config_data)
+
+    if use_cache:
+        try:
+            with cache_path.open('rb') as f:
+                config = pickle.load(f)
+            if isinstance(config, Config):
+                return config, True
+        except Exception:
+            pass
+
+    import json5
+
+    config_json5 = json5.loads(config_data.decode())  # type: ignore
+    config = Config.model_validate(config_json5)  # type: ignore
+
+    if use_cache:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_path.write_bytes(pickle.dumps(config))
+        tmp_path.replace(cache_path)
+
+    return config, False
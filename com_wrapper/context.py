@@ -0,0 +1,182 @@
+import logging
+from pathlib import Path
+from typing import Callable, Iterable, Optional, TypeVar
+
+from config import ActionConfig, AddLogConfig
+from logs import LogFile
+from services import Service
+
+
+class Context:
+    def __init__(self, config_path: Path):
+        self.config_path = config_path
+        self.args: dict[str, str] = {}
+
+        self.oneshot_actions_matched: set[ActionConfig] = set()
+        self.actions_buf_position_map: dict[ActionConfig, int] = {}
+
+        self.log_files: dict[str, LogFile] = {}
+        self.log = bytearray()
+        self.log_history_pos = 0
+        # Offset in the whole program output, kept up to date by the console
+        # loop for the log indexes
+        self.stream_offset = 0
+
+        self.services: dict[str, Service] = {}
+
+    def set_arg(self, name: str, value: str):
+        logging.info(f'Set arg {name}={value}')
+        self.args[name] = value
+
+    def reset_oneshots(self):
+        logging.info('Reset oneshots')
+        self.oneshot_actions_matched.clear()
+
+    def add_oneshot(self, action: ActionConfig):
+        logging.info(f'Add oneshot: {action.model_dump_json(indent=4)}')
+        self.oneshot_actions_matched.add(action)
+
+    def add_log(self, name: str, config: AddLogConfig | None = None):
+        logging.info(f'Add log {name}')
+        if name in self.log_files:
+            logging.info(f'Log {name} already added')
+            return
+
+        self.log_files[name] = LogFile(
+            name,
+            config,
+            self.log,
+            self.log_history_pos,
+        )
+
+    def write_log_history(
+        self,
+        data: bytes,
+        current_data: bytes | None = None,
+    ):
+        for log_file in self.log_files.values():
+            log_file.write(data, current_data, self.stream_offset)
+
+        # Truncate in place, copying the whole history for every line gets
+        # slow for long sessions
+        del self.log[self.log_history_pos :]
+        self.log += data
+        if current_data is not None:
+            self.log += current_data
+        self.log_history_pos += len(data)
+
+    def add_match(self, action: int, stream_offset: int):
+        for log_file in self.log_files.values():
+            log_file.add_match(action, stream_offset)
+
+    def rotate_logs(self):
+        logging.info('Rotate logs')
+        for log_file in self.log_files.values():
+            log_file.rotate()
+
+    def reset_logs(self):
+        logging.info('Reset logs')
+        for log_file in self.log_files.values():
+            log_file.close()
+
+        self.log_files = {}
+        self.log.clear()
+        self.log_history_pos = 0
+
+    def add_service(self, service: Service):
+        self.services[service.name] = service
+
+    def start_service(self, name: str):
+        service = self.services.get(name)
+        if service is None:
+            logging.warning(f'Service {name} not configured')
+            return
+
+        service.start()
+
+    def stop_service(self, name: str):
+        service = self.services.get(name)
+        if service is None:
+            logging.warning(f'Service {name} not configured')
+            return
+
+        service.stop()
+
+    def wait_services_ready(self, names: Iterable[str]) -> bool:
+        for name in names:
+            service = self.services.get(name)
+            if service is None:
+                logging.warning(f'Service {name} not configured')
+                return False
+
+            if not service.wait_ready():
+                return False
+
+        return True
+
+    def stop_services(self):
+        for service in self.services.values():
+            service.stop()
+        for service in self.services.values():
+            service.join()
+
+
+
+T = TypeVar('T', str, bytes)
+
+
+def _replace_text(
+    args: dict[str, str],
+    data: T,
+    needed_args: Optional[Iterable[str]],
+    make_replacee: Callable[[str], T],
+    make_replacement: Callable[[str], T],
+) -> T:
+    logging.debug(f'Replacing args in: {data!r}')
+
+    if needed_args is None:
+        needed_args = args
+
+    for arg in needed_args:
+        if arg not in args:
+            logging.warning(f'Arg {arg} not in context')
+            return type(data)()  # '' or b''
+
+        replacee = make_replacee(arg)
+        replacement = make_replacement(args[arg])
+
+        if replacee not in data:
+            continue
+
+        logging.debug(f'Replacing `{str(replacee)}` with `{str(replacement)}`')
+        data = data.replace(replacee, replacement)
+
+    return data
+
+
+def replace_str_args(
+    context: Context,
+    data: str,
+    needed_args: Optional[Iterable[str]] = None,
+):
+    return _replace_text(
+        context.args,
+        data,
+        needed_args,
+        make_replacee=lambda a: f'${{{a}}}',
+        make_replacement=lambda v: v,
+    )
+
+
+def replace_bytes_args(
+    context: Context,
+    data: bytes,
+    needed_args: Optional[Iterable[str]] = None,
+):
+    return _replace_text(
+        context.args,
+        data,
+        needed_args,
+        make_replacee=lambda a: f'${{{a}}}'.encode(),
+        make_replacement=lambda v: v.encode(),
+    )
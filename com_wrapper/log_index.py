@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import gzip
+import mmap
+import struct
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterator, NamedTuple
+
+# Records are appended in order, so that their line, log offset, stream
+# offset and time all increase and can be bisected on
+INDEX_RECORD = struct.Struct('<BxxxiQQQQ')
+INDEX_KIND_LINE = 0
+INDEX_KIND_MATCH = 1
+
+
+class IndexRecord(NamedTuple):
+    kind: int
+    action: int
+    line: int
+    log_offset: int
+    stream_offset: int
+    time_ns: int
+
+
+def get_index_path(log_path: Path) -> Path:
+    # Compressed segments share the index of the segment they come from
+    name = log_path.name.removesuffix('.gz')
+    return log_path.with_name(f'{name}.idx')
+
+
+class LogIndexWriter:
+    def __init__(self, log_path: Path, interval: int):
+        self.path = get_index_path(log_path)
+        self.file = self.path.open('wb')
+        self.interval = interval
+        self.next_line = 0
+
+    def add(
+        self,
+        kind: int,
+        action: int,
+        line: int,
+        log_offset: int,
+        stream_offset: int,
+    ):
+        self.file.write(
+            INDEX_RECORD.pack(
+                kind,
+                action,
+                line,
+                log_offset,
+                stream_offset,
+                time.time_ns(),
+            )
+        )
+        # Keep the index usable while the session is still running
+        self.file.flush()
+
+    def add_line(self, line: int, log_offset: int, stream_offset: int):
+        if line < self.next_line:
+            return
+
+        self.add(INDEX_KIND_LINE, -1, line, log_offset, stream_offset)
+        self.next_line = line + self.interval
+
+    def add_match(
+        self,
+        action: int,
+        line: int,
+        log_offset: int,
+        stream_offset: int,
+    ):
+        self.add(INDEX_KIND_MATCH, action, line, log_offset, stream_offset)
+
+    def rotate(self, segment_path: Path):
+        self.file.close()
+        self.path.replace(get_index_path(segment_path))
+        self.file = self.path.open('wb')
+
+        # Every segment starts with a record, so that it can be looked up on
+        # its own
+        self.next_line = 0
+
+    def close(self):
+        self.file.close()
+
+
+class IndexedLog:
+    def __init__(self, log_path: Path):
+        self.index_file = get_index_path(log_path).open('rb')
+        self.index = self.mmap_file(self.index_file)
+        self.count = len(self.index) // INDEX_RECORD.size
+
+        if log_path.suffix == '.gz':
+            # Compressed segments cannot be mapped, but they are small
+            self.log_file = None
+            with gzip.open(log_path, 'rb') as f:
+                self.log: bytes | mmap.mmap = f.read()
+        else:
+            self.log_file = log_path.open('rb')
+            self.log = self.mmap_file(self.log_file)
+
+    @staticmethod
+    def mmap_file(f: BinaryIO) -> bytes | mmap.mmap:
+        # Empty files cannot be mapped
+        if not Path(f.name).stat().st_size:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def record(self, i: int) -> IndexRecord:
+        return IndexRecord._make(
+            INDEX_RECORD.unpack_from(self.index, i * INDEX_RECORD.size)
+        )
+
+    def iter_records(self) -> Iterator[IndexRecord]:
+        size = self.count * INDEX_RECORD.size
+        for values in INDEX_RECORD.iter_unpack(self.index[:size]):
+            yield IndexRecord._make(values)
+
+    def bisect(self, field: str, value: int) -> IndexRecord | None:
+        # Last record whose field is at most value
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if getattr(self.record(mid), field) <= value:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if not lo:
+            return None
+        return self.record(lo - 1)
+
+    def first_line(self) -> int:
+        return self.record(0).line if self.count else 0
+
+    def line_offset(self, line: int) -> int:
+        record = self.bisect('line', line)
+        if record is None:
+            return 0
+
+        offset = record.log_offset
+        for _ in range(line - record.line):
+            offset = self.log.find(b'\n', offset) + 1
+            if not offset:
+                return len(self.log)
+
+        return offset
+
+    def time_line(self, time_ns: int) -> int:
+        record = self.bisect('time_ns', time_ns)
+        if record is None:
+            return self.first_line()
+        return record.line
+
+    def stream_line(self, stream_offset: int) -> int:
+        record = self.bisect('stream_offset', stream_offset)
+        if record is None:
+            return self.first_line()
+        return record.line
+
+    def matches(self, action: int | None = None) -> list[IndexRecord]:
+        return [
+            r
+            for r in self.iter_records()
+            if r.kind == INDEX_KIND_MATCH
+            and (action is None or r.action == action)
+        ]
+
+    def read_lines(self, line: int, count: int) -> bytes:
+        start = self.line_offset(line)
+        end = start
+        for _ in range(count):
+            end = self.log.find(b'\n', end) + 1
+            if not end:
+                end = len(self.log)
+                break
+
+        return self.log[start:end]
+
+    def close(self):
+        for m in (self.index, self.log):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        self.index_file.close()
+        if self.log_file is not None:
+            self.log_file.close()
+
+
+def parse_time_ns(value: str) -> int:
+    try:
+        return int(float(value) * 1e9)
+    except ValueError:
+        pass
+
+    return int(datetime.fromisoformat(value).timestamp() * 1e9)
+
+
+def format_time_ns(time_ns: int) -> str:
+    return datetime.fromtimestamp(time_ns / 1e9).isoformat(
+        sep=' ',
+        timespec='milliseconds',
+    )
+
+
+def main():
+    parser = ArgumentParser(
+        description='Look up the console history of a com_wrapper log '
+        'through its index'
+    )
+    parser.add_argument('log', help='Log file or rotated segment')
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument(
+        '-l',
+        '--line',
+        type=int,
+        help='Show the history from the given line number',
+    )
+    query.add_argument(
+        '-t',
+        '--time',
+        help='Show the history from the given time, as an ISO date or a '
+        'UNIX timestamp',
+    )
+    query.add_argument(
+        '-s',
+        '--stream-offset',
+        type=int,
+        help='Show the history from the given offset in the program output',
+    )
+    query.add_argument(
+        '-m',
+        '--match',
+        type=int,
+        help='Show the history around the given match, counted from 0, '
+        'negative values count from the last match',
+    )
+    query.add_argument(
+        '--list-matches',
+        action='store_true',
+        help='List the action matches',
+    )
+    parser.add_argument(
+        '-a',
+        '--action',
+        type=int,
+        help='Only consider the matches of the action with the given index',
+    )
+    parser.add_argument(
+        '-B',
+        '--before',
+        type=int,
+        default=0,
+        help='Number of lines to show before the position',
+    )
+    parser.add_argument(
+        '-n',
+        '--lines',
+        type=int,
+        default=20,
+        help='Number of lines to show from the position',
+    )
+    args = parser.parse_args()
+
+    log = IndexedLog(Path(args.log))
+    try:
+        if args.list_matches:
+            for i, r in enumerate(log.matches(args.action)):
+                print(
+                    f'{i}: {format_time_ns(r.time_ns)} action {r.action} '
+                    f'line {r.line} stream offset {r.stream_offset}'
+                )
+            return
+
+        if args.line is not None:
+            line = args.line
+        elif args.time is not None:
+            line = log.time_line(parse_time_ns(args.time))
+        elif args.stream_offset is not None:
+            line = log.stream_line(args.stream_offset)
+        else:
+            matches = log.matches(args.action)
+            try:
+                line = matches[args.match].line
+            except IndexError:
+                sys.exit(f'No match {args.match}, {len(matches)} matches')
+
+        if line < log.first_line():
+            sys.exit(
+                f'Line {line} is before the first line of the log, '
+                f'{log.first_line()}'
+            )
+
+        start = max(line - args.before, log.first_line())
+        count = line - start + args.lines
+        sys.stdout.buffer.write(log.read_lines(start, count))
+    finally:
+        log.close()
+
+
+if __name__ == '__main__':
+    main()
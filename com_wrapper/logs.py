@@ -0,0 +1,179 @@
+import gzip
+import logging
+import os
+import re
+import shutil
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
+
+from config import AddLogConfig
+from log_index import INDEX_KIND_LINE, LogIndexWriter, get_index_path
+
+_compress_executor: Executor | None = None
+
+
+def get_compress_executor() -> Executor:
+    # A single worker keeps the compressions and the pruning of every log in
+    # order, its thread is joined at exit so that no segment is left behind
+    global _compress_executor
+    if _compress_executor is None:
+        _compress_executor = ThreadPoolExecutor(1, 'log-compress')
+    return _compress_executor
+
+
+def compress_segment(path: Path):
+    gz_path = path.with_name(path.name + '.gz')
+    tmp_path = gz_path.with_name(gz_path.name + '.tmp')
+    try:
+        with path.open('rb') as f, gzip.open(tmp_path, 'wb') as gz_f:
+            shutil.copyfileobj(f, gz_f)
+        tmp_path.replace(gz_path)
+        path.unlink()
+    except OSError as e:
+        logging.error(f'Failed to compress log segment {path}: {e}')
+
+
+def remove_segments(paths: list[Path]):
+    for path in paths:
+        gz_path = path.with_name(path.name + '.gz')
+        for p in (path, gz_path, get_index_path(path)):
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def get_last_segment_index(path: Path) -> int:
+    segment_re = re.compile(rf'{re.escape(path.name)}\.(\d+)(?:\.gz)?')
+    last_index = 0
+    for p in path.parent.glob(f'{path.name}.*'):
+        m = segment_re.fullmatch(p.name)
+        if m:
+            last_index = max(last_index, int(m.group(1)))
+    return last_index
+
+
+class LogFile:
+    def __init__(
+        self,
+        name: str,
+        config: AddLogConfig | None,
+        data: bytes,
+        history_pos: int,
+    ):
+        self.path = Path(name)
+        self.max_size = config.max_size if config else None
+        self.max_age = config.max_age if config else None
+        self.keep = config.keep if config else None
+        self.compress = config.compress if config else False
+
+        self.file = self.path.open('w+b')
+        self.file.write(data)
+        self.file.flush()
+
+        # Only the current segment is rewritten, the history before this
+        # position does not change anymore
+        self.history_pos = history_pos
+        self.start_time = time.monotonic()
+        self.line = data[:history_pos].count(b'\n')
+
+        self.index = None
+        if config is not None and config.index_lines:
+            self.index = LogIndexWriter(self.path, config.index_lines)
+            if history_pos:
+                # The history added before the log was, only its start is
+                # known
+                self.index.add(INDEX_KIND_LINE, -1, 0, 0, 0)
+
+        self.segment_index = 0
+        self.segments: list[Path] = []
+
+    def write(
+        self,
+        data: bytes,
+        current_data: bytes | None,
+        stream_offset: int,
+    ):
+        if self.index is not None:
+            self.index.add_line(self.line, self.history_pos, stream_offset)
+
+        self.file.seek(self.history_pos, os.SEEK_SET)
+        self.file.truncate()
+        self.file.write(data)
+        if current_data is not None:
+            self.file.write(current_data)
+        self.file.flush()
+        self.history_pos += len(data)
+        self.line += data.count(b'\n')
+
+        if self.is_rotation_due():
+            self.rotate()
+
+    def is_rotation_due(self) -> bool:
+        if self.max_size is not None and self.history_pos >= self.max_size:
+            return True
+
+        if self.max_age is not None:
+            return time.monotonic() - self.start_time >= self.max_age
+
+        return False
+
+    def rotate(self):
+        if not self.history_pos:
+            return
+
+        # The rotated segment only keeps the history, the current screen
+        # moves to the new segment
+        self.file.seek(self.history_pos, os.SEEK_SET)
+        current_data = self.file.read()
+        self.file.truncate(self.history_pos)
+        self.file.close()
+
+        # Carry on from the segments left by previous sessions, without
+        # overwriting them
+        if not self.segments:
+            self.segment_index = get_last_segment_index(self.path)
+        self.segment_index += 1
+        segment_path = self.path.with_name(
+            f'{self.path.name}.{self.segment_index}'
+        )
+        self.path.replace(segment_path)
+        if self.index is not None:
+            self.index.rotate(segment_path)
+        logging.info(f'Rotated log {self.path} to {segment_path}')
+
+        self.file = self.path.open('w+b')
+        self.file.write(current_data)
+        self.file.flush()
+        self.history_pos = 0
+        self.start_time = time.monotonic()
+
+        self.segments.append(segment_path)
+        removed_segments: list[Path] = []
+        if self.keep is not None and len(self.segments) > self.keep:
+            removed_segments = self.segments[: -self.keep]
+            self.segments = self.segments[-self.keep :]
+
+        if not self.compress and not removed_segments:
+            return
+
+        executor = get_compress_executor()
+        if self.compress:
+            executor.submit(compress_segment, segment_path)
+        if removed_segments:
+            executor.submit(remove_segments, removed_segments)
+
+    def add_match(self, action: int, stream_offset: int):
+        if self.index is not None:
+            self.index.add_match(
+                action,
+                self.line,
+                self.history_pos,
+                stream_offset,
+            )
+
+    def close(self):
+        self.file.close()
+        if self.index is not None:
+            self.index.close()
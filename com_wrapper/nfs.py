@@ -0,0 +1,231 @@
+import hashlib
+import logging
+import os
+import signal
+import socket
+import subprocess
+import tempfile
+from contextlib import nullcontext
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from typing import ContextManager
+
+from config import NfsConfig
+from context import Context, replace_str_args
+
+NFS_POLL_S = 0.5
+NFS_READY_POLL_S = 0.1
+NFS_PROBE_TIMEOUT_S = 0.2
+NFS_RESTART_DELAY_S = 1
+NFS_STOP_TIMEOUT_S = 5
+
+
+def get_nfs_run_dir(conf_text: str) -> Path:
+    # Keyed by the config, so that a ganesha left running by a previous
+    # session is only reused if it exports the same thing
+    digest = hashlib.sha256(conf_text.encode()).hexdigest()[:16]
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir())
+    return Path(runtime_dir, 'com_wrapper-nfs', digest)
+
+
+def probe_port(ip: str, port: int) -> bool:
+    if ip in ('', '0.0.0.0', '::'):
+        ip = '127.0.0.1'
+
+    try:
+        with socket.create_connection((ip, port), NFS_PROBE_TIMEOUT_S):
+            return True
+    except OSError:
+        return False
+
+
+class NfsProcess:
+    def __init__(
+        self,
+        pid: int,
+        proc: subprocess.Popen[bytes] | None = None,
+    ):
+        # proc is None for a ganesha adopted from a previous session, which
+        # is not our child
+        self.pid = pid
+        self.proc = proc
+
+    def is_alive(self, conf_path: Path) -> bool:
+        if self.proc is not None:
+            return self.proc.poll() is None
+
+        try:
+            cmdline = Path(f'/proc/{self.pid}/cmdline').read_bytes()
+        except OSError:
+            return False
+
+        args = cmdline.split(b'\0')
+        return (
+            any(arg.endswith(b'ganesha.nfsd') for arg in args)
+            and str(conf_path).encode() in args
+        )
+
+    def terminate(self, conf_path: Path):
+        if self.proc is None:
+            if self.is_alive(conf_path):
+                os.kill(self.pid, signal.SIGTERM)
+            return
+
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=NFS_STOP_TIMEOUT_S)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+
+
+def adopt_nfs(pid_path: Path, conf_path: Path) -> NfsProcess | None:
+    try:
+        pid = int(pid_path.read_text())
+    except (OSError, ValueError):
+        return None
+
+    proc = NfsProcess(pid)
+    if not proc.is_alive(conf_path):
+        return None
+
+    logging.info(f'NFS reusing running ganesha, pid {pid}')
+    return proc
+
+
+def spawn_nfs(
+    conf_path: Path,
+    log_path: Path,
+    pid_path: Path,
+    persistent: bool,
+) -> NfsProcess:
+    proc = subprocess.Popen(
+        [
+            'ganesha.nfsd',
+            '-F',
+            '-f',
+            str(conf_path),
+            '-L',
+            str(log_path),
+        ],
+        # Keep a persistent ganesha out of our session, so that it survives
+        # the terminal going away
+        start_new_session=persistent,
+    )
+    pid_path.write_text(f'{proc.pid}\n')
+    logging.info(f'NFS started ganesha, pid {proc.pid}')
+
+    return NfsProcess(proc.pid, proc)
+
+
+def nfs_thread_fn(
+    config: NfsConfig,
+    conf_text: str,
+    server_ip: str,
+    server_port: int,
+    stop_event: Event,
+    ready_event: Event,
+):
+    run_dir_ctx: ContextManager[str]
+    if config.persistent:
+        run_dir = get_nfs_run_dir(conf_text)
+        run_dir.mkdir(parents=True, exist_ok=True)
+        run_dir_ctx = nullcontext(str(run_dir))
+    else:
+        run_dir_ctx = TemporaryDirectory(prefix='nfs-')
+
+    with run_dir_ctx as tmpdir:
+        conf_path = Path(tmpdir) / 'ganesha.conf'
+        log_path = Path(tmpdir) / 'ganesha.log'
+        pid_path = Path(tmpdir) / 'ganesha.pid'
+        conf_path.write_text(conf_text)
+
+        proc = None
+        if config.persistent:
+            proc = adopt_nfs(pid_path, conf_path)
+
+        try:
+            while not stop_event.is_set():
+                if proc is not None and not proc.is_alive(conf_path):
+                    ready_event.clear()
+                    if not config.restart:
+                        logging.error('NFS ganesha exited')
+                        break
+
+                    logging.warning('NFS ganesha exited, restarting')
+                    proc = None
+                    if stop_event.wait(NFS_RESTART_DELAY_S):
+                        break
+
+                if proc is None:
+                    try:
+                        proc = spawn_nfs(
+                            conf_path,
+                            log_path,
+                            pid_path,
+                            config.persistent,
+                        )
+                    except OSError as e:
+                        logging.error(f'NFS failed to start ganesha: {e}')
+                        break
+
+                if not ready_event.is_set():
+                    if probe_port(server_ip, server_port):
+                        logging.info('NFS ready')
+                        ready_event.set()
+                    else:
+                        stop_event.wait(NFS_READY_POLL_S)
+                        continue
+
+                stop_event.wait(NFS_POLL_S)
+        finally:
+            ready_event.clear()
+            if proc is not None and not config.persistent:
+                proc.terminate(conf_path)
+
+
+def setup_nfs(
+    config: NfsConfig,
+    context: Context,
+    stop_event: Event,
+    ready_event: Event,
+):
+    server_ip = replace_str_args(context, config.server_ip)
+    server_port = replace_str_args(context, config.server_port)
+
+    conf_text = f"""
+NFS_Core_Param {{
+    Bind_addr = {server_ip};
+    NFS_Port = {server_port};
+}}
+
+EXPORT {{
+    Export_Id = 1;
+    Path = {config.path};
+    Pseudo = {config.pseudo};
+    Access_Type = RW;
+    Squash = No_Root_Squash;
+    Protocols = 3,4;
+    Transports = TCP;
+    FSAL {{
+        Name = VFS;
+    }}
+}}
+"""
+    t = Thread(
+        target=nfs_thread_fn,
+        args=(
+            config,
+            conf_text,
+            server_ip,
+            int(server_port),
+            stop_event,
+            ready_event,
+        ),
+        name='nfs-server',
+    )
+    t.start()
+
+    return t
@@ -0,0 +1,131 @@
+import mmap
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from threading import Thread
+from typing import Callable, Iterator
+
+# A recording is a header followed by records appended as the data is read
+# from the PTY, each record being the time since the start of the recording
+# and the raw bytes
+RECORDING_MAGIC = b'CWREC\x00\x01\n'
+RECORDING_HEADER = struct.Struct('<8sQ')
+RECORDING_RECORD = struct.Struct('<QI')
+RECORDING_BUFFER_LEN = 64 * 1024
+REPLAY_CHUNK_LEN = 1024
+
+
+class Recorder:
+    def __init__(self, path: str):
+        self.file = open(path, 'wb', buffering=RECORDING_BUFFER_LEN)
+        self.start_ns = time.monotonic_ns()
+        self.file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, time.time_ns()))
+
+    def write(self, data: bytes):
+        delta_ns = time.monotonic_ns() - self.start_ns
+        self.file.write(RECORDING_RECORD.pack(delta_ns, len(data)))
+        self.file.write(data)
+
+    def recorded(self, read_fn: Callable[[int, int], bytes]):
+        write = self.write
+
+        def wrapper(fd: int, length: int) -> bytes:
+            data = read_fn(fd, length)
+            if data:
+                write(data)
+            return data
+
+        return wrapper
+
+    def close(self):
+        self.file.close()
+
+
+def is_recording(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(RECORDING_MAGIC)) == RECORDING_MAGIC
+
+
+def iter_recording(path: str) -> Iterator[tuple[int, bytes]]:
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < RECORDING_HEADER.size:
+            raise ValueError(f'{path}: not a recording')
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, _ = RECORDING_HEADER.unpack_from(mm, 0)
+            if magic != RECORDING_MAGIC:
+                raise ValueError(f'{path}: not a recording')
+
+            offset = RECORDING_HEADER.size
+            while offset + RECORDING_RECORD.size <= size:
+                delta_ns, length = RECORDING_RECORD.unpack_from(mm, offset)
+                offset += RECORDING_RECORD.size
+
+                # A truncated record is left by a session that did not exit
+                # cleanly, ignore it
+                if offset + length > size:
+                    break
+
+                yield delta_ns, mm[offset : offset + length]
+                offset += length
+
+
+def read_recording_data(path: str) -> bytes:
+    return b''.join(data for _, data in iter_recording(path))
+
+
+def replay_recording(path: str, fd: int, speed: float):
+    # Keep draining what is written to the program while replaying, so that
+    # input and scripted writes never block the console loop
+    os.set_blocking(fd, False)
+    start_ns = time.monotonic_ns()
+
+    for delta_ns, data in iter_recording(path):
+        due_ns = start_ns + int(delta_ns / speed) if speed else 0
+        view = memoryview(data)
+
+        while view:
+            timeout = max(0, due_ns - time.monotonic_ns()) / 1e9
+            wlist = [fd] if not timeout else []
+            rlist, wlist, _ = select.select(
+                [fd],
+                wlist,
+                [],
+                timeout if timeout else None,
+            )
+
+            if rlist:
+                try:
+                    os.read(fd, REPLAY_CHUNK_LEN)
+                except BlockingIOError:
+                    pass
+
+            if wlist:
+                try:
+                    view = view[os.write(fd, view) :]
+                except BlockingIOError:
+                    pass
+
+
+def replay_thread_fn(path: str, fd: int, speed: float):
+    try:
+        replay_recording(path, fd, speed)
+    finally:
+        # Reading the other side of the PTY fails once this is closed, which
+        # ends the session
+        os.close(fd)
+
+
+def setup_replay(path: Path, fd: int, speed: float):
+    t = Thread(
+        target=replay_thread_fn,
+        args=(str(path), fd, speed),
+        name='replay',
+        daemon=True,
+    )
+    t.start()
+
+    return t
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import ctypes
 import fcntl
 import logging
@@ -7,175 +9,43 @@ import os
 import pty
 import re
 import select
+import signal
 import struct
 import subprocess
 import sys
 import termios
-import time
 import traceback
 import tty
 from argparse import ArgumentParser
-from functools import partial
 from pathlib import Path
-from tempfile import TemporaryDirectory
 from threading import Event, Thread
-from typing import Any, BinaryIO, Callable, Iterable, Optional, TypeVar
+from typing import TYPE_CHECKING, Any
 
-import json5
 from config import (
     ActionConfig,
     Config,
     RunWriteConfig,
     RunWriteFromFileConfig,
+    load_config,
 )
-from utils import delay_us
-from vterm import (
-    get_vterm_row_data,
-    get_vterm_screen_data,
-    get_vterm_stripped_row,
-)
-from vterm_bindings import (
-    SBPushLineCB,
-    VTerm,
-    VTermScreen,
-    VTermScreenCallbacks,
-    vterm_lib,
-)
+from context import Context, replace_bytes_args, replace_str_args
+from recording import Recorder
+from services import setup_services
+from stats import Stats
+from utils import StartupProfile, delay_us
+
+if TYPE_CHECKING:
+    from vterm_bindings import VTerm, VTermScreen
 
 MAX_BUF_LEN = 4096
 CHUNK_LEN = 1024
 
-logging.getLogger('tftpy').setLevel(logging.WARNING)
-
-
-class Context:
-    def __init__(self, config_path: Path):
-        self.config_path = config_path
-        self.args: dict[str, str] = {}
-
-        self.oneshot_actions_matched: set[ActionConfig] = set()
-        self.actions_buf_position_map: dict[ActionConfig, int] = {}
-
-        self.log_files: dict[str, BinaryIO] = {}
-        self.log = bytearray()
-        self.log_history_pos = 0
-
-    def set_arg(self, name: str, value: str):
-        logging.info(f'Set arg {name}={value}')
-        self.args[name] = value
-
-    def reset_oneshots(self):
-        logging.info('Reset oneshots')
-        self.oneshot_actions_matched.clear()
-
-    def add_oneshot(self, action: ActionConfig):
-        logging.info(f'Add oneshot: {action.model_dump_json(indent=4)}')
-        self.oneshot_actions_matched.add(action)
-
-    def add_log(self, name: str):
-        logging.info(f'Add log {name}')
-        if name in self.log_files:
-            logging.info(f'Log {name} already added')
-            return
-
-        log_file = open(name, 'wb')
-        log_file.write(self.log)
-        self.log_files[name] = log_file
-
-    def write_log_history(
-        self,
-        data: bytes,
-        current_data: bytes | None = None,
-    ):
-        for log_file in self.log_files.values():
-            log_file.seek(self.log_history_pos, os.SEEK_SET)
-            log_file.truncate()
-            log_file.write(data)
-            if current_data is not None:
-                log_file.write(current_data)
-            log_file.flush()
-
-        self.log = self.log[: self.log_history_pos]
-        self.log += data
-        if current_data is not None:
-            self.log += current_data
-        self.log_history_pos += len(data)
-
-    def reset_logs(self):
-        logging.info('Reset logs')
-        for log_file in self.log_files.values():
-            log_file.close()
-
-        self.log_files = {}
-        self.log.clear()
-        self.log_history_pos = 0
-
 
 def get_terminal_size(fd: int) -> tuple[int, int, int, int]:
     data = fcntl.ioctl(fd, termios.TIOCGWINSZ, b'\0' * 8)
     return struct.unpack('HHHH', data)
 
 
-T = TypeVar('T', str, bytes)
-
-
-def _replace_text(
-    args: dict[str, str],
-    data: T,
-    needed_args: Optional[Iterable[str]],
-    make_replacee: Callable[[str], T],
-    make_replacement: Callable[[str], T],
-) -> T:
-    logging.debug(f'Replacing args in: {data!r}')
-
-    if needed_args is None:
-        needed_args = args
-
-    for arg in needed_args:
-        if arg not in args:
-            logging.warning(f'Arg {arg} not in context')
-            return type(data)()  # '' or b''
-
-        replacee = make_replacee(arg)
-        replacement = make_replacement(args[arg])
-
-        if replacee not in data:
-            continue
-
-        logging.debug(f'Replacing `{str(replacee)}` with `{str(replacement)}`')
-        data = data.replace(replacee, replacement)
-
-    return data
-
-
-def replace_str_args(
-    context: Context,
-    data: str,
-    needed_args: Optional[Iterable[str]] = None,
-):
-    return _replace_text(
-        context.args,
-        data,
-        needed_args,
-        make_replacee=lambda a: f'${{{a}}}',
-        make_replacement=lambda v: v,
-    )
-
-
-def replace_bytes_args(
-    context: Context,
-    data: bytes,
-    needed_args: Optional[Iterable[str]] = None,
-):
-    return _replace_text(
-        context.args,
-        data,
-        needed_args,
-        make_replacee=lambda a: f'${{{a}}}'.encode(),
-        make_replacement=lambda v: v.encode(),
-    )
-
-
 def run_write_action(
     config: Config,
     context: Context,
@@ -183,6 +53,11 @@ def run_write_action(
     run: RunWriteConfig | RunWriteFromFileConfig,
 ):
     logging.debug(f'Running write: {run.model_dump_json(indent=4)}')
+    if run.needed_services and not context.wait_services_ready(
+        run.needed_services
+    ):
+        return
+
     data: bytes = bytes()
     if run.type == 'write':
         data = run.value.encode('utf-8')
@@ -216,6 +91,8 @@ def run_action(
     logging.debug(f'Running action: {action.model_dump_json(indent=4)}')
     if action.reset_logs:
         context.reset_logs()
+    if action.rotate_logs:
+        context.rotate_logs()
     if action.reset_oneshots:
         context.reset_oneshots()
     if action.oneshot:
@@ -233,9 +110,13 @@ def run_action(
                 name = replace_str_args(context, name, run.needed_args)
             if not name:
                 return
-            context.add_log(name)
+            context.add_log(name, run)
         elif run.type == 'set_arg':
             context.set_arg(run.name, run.value)
+        elif run.type == 'start_service':
+            context.start_service(run.name)
+        elif run.type == 'stop_service':
+            context.stop_service(run.name)
 
 
 def match_buffer_actions(
@@ -245,7 +126,7 @@ def match_buffer_actions(
     buf_total_length: int,
     master_fd: int,
 ):
-    for action in config.actions:
+    for i, action in enumerate(config.actions):
         if action in context.oneshot_actions_matched:
             continue
 
@@ -272,9 +153,57 @@ def match_buffer_actions(
                     continue
 
             context.actions_buf_position_map[action] = found_index_total
+            context.add_match(i, found_index_total)
             run_action(config, context, master_fd, action)
 
 
+def enable_stats(context: Context, stats: Stats):
+    global match_buffer_actions, run_action, run_write_action
+
+    match_buffer_actions = stats.timed(
+        'match_buffer_actions',
+        match_buffer_actions,
+    )
+    run_action = stats.counted_calls('matches', run_action)
+    run_write_action = stats.timed('run_write_action', run_write_action)
+    context.write_log_history = stats.timed(  # type: ignore
+        'write_log_history',
+        context.write_log_history,
+    )
+
+
+def stats_thread_fn(stats: Stats, interval: float, stop_event: Event):
+    while not stop_event.wait(interval):
+        logging.info(f'Stats: {stats.format()}')
+
+
+def setup_stats(
+    context: Context,
+    stats: Stats,
+    interval: float,
+    stop_event: Event,
+):
+    enable_stats(context, stats)
+
+    def on_sigusr1(_signum: int, _frame: Any):
+        logging.info(f'Stats: {stats.format()}')
+
+    signal.signal(signal.SIGUSR1, on_sigusr1)
+
+    if not interval:
+        return None
+
+    t = Thread(
+        target=stats_thread_fn,
+        args=(stats, interval, stop_event),
+        name='stats',
+        daemon=True,
+    )
+    t.start()
+
+    return t
+
+
 def process_input_output(
     config: Config,
     context: Context,
@@ -283,20 +212,41 @@ def process_input_output(
     master_fd: int,
     vterm: VTerm,
     vterm_screen: VTermScreen,
+    stats: Stats | None = None,
+    recorder: Recorder | None = None,
 ):
+    from vterm import capture_cells, get_vterm_screen_data
+    from vterm_bindings import (
+        SBPushLineCB,
+        VTermScreenCallbacks,
+        vterm_lib,
+    )
+
     buf = bytearray()
     buf_total_length = 0
 
-    @SBPushLineCB
+    read_master = os.read
+    write_stdout = os.write
+    vterm_input_write = vterm_lib.vterm_input_write
+    capture_attrs = config.capture_attrs
+
     def on_sb_pushline(cols: int, cells: Any, _user: ctypes.c_void_p):
-        row_data = get_vterm_row_data(cols, cells)
-        stripped_row_data = get_vterm_stripped_row(row_data)
-        screen_data = get_vterm_screen_data(vterm, vterm_screen)
-        context.write_log_history(stripped_row_data, screen_data)
+        row = capture_cells(cols, cells, capture_attrs)
+        screen_data = get_vterm_screen_data(vterm, vterm_screen, capture_attrs)
+        context.write_log_history(row.to_bytes(), screen_data)
         return 1
 
+    if recorder is not None:
+        read_master = recorder.recorded(read_master)
+
+    if stats is not None:
+        read_master = stats.counted_result('bytes_in', read_master, len)
+        write_stdout = stats.counted_result('bytes_out', write_stdout, int)
+        vterm_input_write = stats.timed('vterm_input_write', vterm_input_write)
+        on_sb_pushline = stats.timed('on_sb_pushline', on_sb_pushline)
+
     cb = VTermScreenCallbacks()
-    cb.sb_pushline = on_sb_pushline
+    cb.sb_pushline = SBPushLineCB(on_sb_pushline)
     vterm_lib.vterm_screen_set_callbacks(vterm_screen, ctypes.byref(cb), None)
 
     while True:
@@ -314,7 +264,7 @@ def process_input_output(
 
         if master_fd in rlist:
             try:
-                data = os.read(master_fd, CHUNK_LEN)
+                data = read_master(master_fd, CHUNK_LEN)
             except OSError:
                 break
             if not data:
@@ -322,6 +272,7 @@ def process_input_output(
 
             buf.extend(data)
             buf_total_length += len(data)
+            context.stream_offset = buf_total_length
 
             if len(buf) > MAX_BUF_LEN:
                 buf = buf[-MAX_BUF_LEN:]
@@ -336,174 +287,32 @@ def process_input_output(
 
             logging.debug(f'Received {data!r}')
 
-            os.write(stdout_fd, data)
-            vterm_lib.vterm_input_write(vterm, data, len(data))
+            write_stdout(stdout_fd, data)
+            vterm_input_write(vterm, data, len(data))
 
-    screen_data = get_vterm_screen_data(vterm, vterm_screen)
+    screen_data = get_vterm_screen_data(vterm, vterm_screen, capture_attrs)
     context.write_log_history(screen_data)
 
     vterm_lib.vterm_free(vterm)
 
 
-def dyn_file_func(
+def run_wrapper(
     config: Config,
     context: Context,
-    file_path: str,
-    raddress: str,
-    rport: int,
+    stats: Stats | None = None,
+    recorder: Recorder | None = None,
+    replay_path: Path | None = None,
+    replay_speed: float = 1,
 ):
-    logging.debug(f'TFTP requested path {file_path}')
-    if file_path[0] == '/':
-        file_path = file_path[1:]
-
-    fp = Path(file_path)
-    for (
-        dst_file_path,
-        src_file_path,
-    ) in config.tftp.mounts:
-        dst_file_path = replace_str_args(context, dst_file_path)
-        src_file_path = replace_str_args(context, src_file_path)
-
-        logging.debug(f'TFTP trying {src_file_path} -> {dst_file_path}')
-
-        if src_file_path[0] == '/':
-            src_file_path = src_file_path[1:]
-
-        dp = Path(dst_file_path)
-        sp = Path(src_file_path)
-
-        if fp == sp:
-            real = dp
-        elif fp.is_relative_to(sp):
-            rp = fp.relative_to(sp)
-            real = dp.joinpath(rp)
-        else:
-            continue
-
-        logging.debug(f'TFTP resolved: {real}')
-
-        real = real.resolve()
-        if not real.is_relative_to(dp):
-            logging.debug(f'TFTP path outside of destination: {real}')
-            continue
+    from vterm_bindings import vterm_lib
 
-        if not real.exists():
-            logging.debug(f'TFTP path does not exist: {real}')
-            return None
-
-        return real.open('rb')
-
-    return None
-
-
-def tftp_thread_fn(config: Config, context: Context, stop_event: Event):
-    import tftpy  # type: ignore
-
-    with TemporaryDirectory(prefix='tftp-') as tmp_root:
-        dyn_file_func_fn = partial(dyn_file_func, config, context)
-        server = tftpy.TftpServer(tmp_root, dyn_file_func=dyn_file_func_fn)
-        server_ip = replace_str_args(context, config.tftp.server_ip)
-        server_port = replace_str_args(context, config.tftp.server_port)
-
-        listen_t = Thread(
-            target=server.listen,
-            args=(server_ip, int(server_port)),
-            name='tftp-listen',
-        )
-        listen_t.start()
-
-        stop_event.wait()
-        try:
-            server.stop()
-        finally:
-            listen_t.join()
-
-
-def setup_tftp(config: Config, context: Context, stop_event: Event):
-    t = Thread(
-        target=tftp_thread_fn,
-        args=(config, context, stop_event),
-        name='tftp-server',
-    )
-    t.start()
-
-    return t
-
-
-def nfs_thread_fn(conf_text: str, stop_event: Event):
-    with TemporaryDirectory(prefix='nfs-') as tmpdir:
-        conf_path = Path(tmpdir) / 'ganesha.conf'
-        conf_path.write_text(conf_text)
-
-        proc = subprocess.Popen(
-            [
-                'ganesha.nfsd',
-                '-F',
-                '-f',
-                str(conf_path),
-            ]
-        )
-
-        try:
-            while proc.poll() is None and not stop_event.is_set():
-                time.sleep(0.5)
-
-            if proc.poll() is None:
-                proc.terminate()
-                try:
-                    proc.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    proc.kill()
-        finally:
-            if proc.poll() is None:
-                proc.kill()
-                proc.wait()
-
-
-def setup_nfs(
-    config: Config,
-    context: Context,
-    stop_event: Event,
-):
-    server_ip = replace_str_args(context, config.nfs.server_ip)
-    server_port = replace_str_args(context, config.nfs.server_port)
-
-    conf_text = f"""
-NFS_Core_Param {{
-    Bind_addr = {server_ip};
-    NFS_Port = {server_port};
-}}
-
-EXPORT {{
-    Export_Id = 1;
-    Path = {config.nfs.path};
-    Pseudo = {config.nfs.pseudo};
-    Access_Type = RW;
-    Squash = No_Root_Squash;
-    Protocols = 3,4;
-    Transports = TCP;
-    FSAL {{
-        Name = VFS;
-    }}
-}}
-"""
-    t = Thread(
-        target=nfs_thread_fn,
-        args=(conf_text, stop_event),
-        name='nfs-server',
-    )
-    t.start()
-
-    return t
-
-
-def run_wrapper(config: Config, context: Context):
     master_fd, slave_fd = pty.openpty()
     stdin_fd = sys.stdin.fileno()
     stdout_fd = sys.stdout.fileno()
 
     rows, cols, xpix, ypix = get_terminal_size(stdin_fd)
     vterm = vterm_lib.vterm_new(rows, cols)
+    vterm_lib.vterm_set_utf8(vterm, 1)
     vterm_screen = vterm_lib.vterm_obtain_screen(vterm)
     vterm_lib.vterm_screen_reset(vterm_screen, 0)
 
@@ -519,14 +328,24 @@ def run_wrapper(config: Config, context: Context):
     except Exception as e:
         logging.error(e)
 
-    proc = subprocess.Popen(
-        config.program,
-        stdin=slave_fd,
-        stdout=slave_fd,
-        stderr=subprocess.STDOUT,
-        close_fds=True,
-    )
-    os.close(slave_fd)
+    proc = None
+    if replay_path is not None:
+        from recording import setup_replay
+
+        # The recording replaces the program, do not echo what is written to
+        # it, the replay thread owns the slave from now on
+        tty.setraw(slave_fd)
+        setup_replay(replay_path, slave_fd, replay_speed)
+    else:
+        proc = subprocess.Popen(
+            config.program,
+            stdin=slave_fd,
+            stdout=slave_fd,
+            stderr=subprocess.STDOUT,
+            close_fds=True,
+        )
+        os.close(slave_fd)
+
     old_tty = termios.tcgetattr(stdin_fd)
     tty.setraw(stdin_fd)
 
@@ -539,6 +358,8 @@ def run_wrapper(config: Config, context: Context):
             master_fd,
             vterm,
             vterm_screen,
+            stats,
+            recorder,
         )
     except KeyboardInterrupt:
         pass
@@ -547,8 +368,9 @@ def run_wrapper(config: Config, context: Context):
     finally:
         termios.tcsetattr(stdin_fd, termios.TCSADRAIN, old_tty)
         os.close(master_fd)
-        proc.terminate()
-        proc.wait()
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
 
 
 def main():
@@ -573,13 +395,55 @@ def main():
         action='store_true',
         help='Enable debug logging',
     )
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        help='Instrument the console hot path, dump the stats to the log '
+        'periodically and on SIGUSR1',
+    )
+    parser.add_argument(
+        '--stats-interval',
+        type=float,
+        default=10,
+        help='Interval in seconds of the periodic stats, 0 to only dump them '
+        'on SIGUSR1',
+    )
+    parser.add_argument(
+        '--no-config-cache',
+        action='store_true',
+        help='Always parse and validate the config instead of using the cache',
+    )
+    parser.add_argument(
+        '--profile-startup',
+        action='store_true',
+        help='Print the time spent in each startup phase and exit before '
+        'starting the services and the program',
+    )
+    parser.add_argument(
+        '--record',
+        metavar='FILE',
+        help='Record the raw output of the program along with its timing',
+    )
+    parser.add_argument(
+        '--replay',
+        metavar='FILE',
+        help='Replay a recording instead of running the program',
+    )
+    parser.add_argument(
+        '--replay-speed',
+        type=float,
+        default=1,
+        help='Speed factor of the replay, 0 to replay as fast as possible',
+    )
     args = parser.parse_args()
 
+    profile = StartupProfile()
+    profile.mark('imports')
+
     config_path = Path(args.config)
-    config_data = config_path.read_text()
-    config_json5 = json5.loads(config_data)  # type: ignore
-    config = Config.model_validate(config_json5)  # type: ignore
+    config, config_cached = load_config(config_path, not args.no_config_cache)
     context = Context(config_path)
+    profile.mark('config (cached)' if config_cached else 'config')
 
     logging.basicConfig(
         filename='log.txt',
@@ -588,7 +452,11 @@ def main():
         format='%(asctime)s [%(levelname)s] %(message)s',
     )
 
-    logging.info(f'Config: {config.model_dump_json(indent=4)}')
+    # Dumping the config needs the validators that are not built for cached
+    # configs, only pay for it when debugging
+    logging.info(f'Config: {config_path}, cached: {config_cached}')
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f'Config: {config.model_dump_json(indent=4)}')
 
     for k, v in config.args.items():
         context.set_arg(k, v)
@@ -598,15 +466,47 @@ def main():
         k, v = kv.split('=', 1)
         context.set_arg(k, v)
 
+    profile.mark('logging and args')
+
     stop_event = Event()
 
-    tftp_thread = setup_tftp(config, context, stop_event)
-    nfs_thread = setup_nfs(config, context, stop_event)
-    run_wrapper(config, context)
+    if args.profile_startup:
+        import vterm_bindings  # noqa: F401
+
+        profile.mark('vterm import')
+        print(profile.format(), file=sys.stderr)
+        return
+
+    stats = None
+    if args.stats:
+        stats = Stats()
+        setup_stats(context, stats, args.stats_interval, stop_event)
+
+    recorder = None
+    if args.record:
+        recorder = Recorder(args.record)
+
+    replay_path = None
+    if args.replay:
+        replay_path = Path(args.replay)
+        logging.info(f'Replaying: {replay_path}, speed: {args.replay_speed}')
+
+    setup_services(config, context)
+    try:
+        run_wrapper(
+            config,
+            context,
+            stats,
+            recorder,
+            replay_path,
+            args.replay_speed,
+        )
+    finally:
+        if recorder is not None:
+            recorder.close()
 
     stop_event.set()
-    tftp_thread.join()
-    nfs_thread.join()
+    context.stop_services()
 
 
 if __name__ == '__main__':
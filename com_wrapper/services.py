@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import logging
+from threading import Event, Thread
+from typing import TYPE_CHECKING, Callable
+
+from config import Config
+
+if TYPE_CHECKING:
+    from context import Context
+
+StartServiceFn = Callable[[Event, Event], Thread]
+
+
+class Service:
+    def __init__(
+        self,
+        name: str,
+        start_fn: StartServiceFn,
+        ready_timeout: float,
+    ):
+        self.name = name
+        self.start_fn = start_fn
+        self.ready_timeout = ready_timeout
+        self.stop_event = Event()
+        self.ready_event = Event()
+        self.thread: Thread | None = None
+
+    def is_running(self):
+        return self.thread is not None and not self.stop_event.is_set()
+
+    def run(
+        self,
+        previous: Thread | None,
+        stop_event: Event,
+        ready_event: Event,
+    ):
+        # Wait for a previous instance to release its resources, outside of
+        # the console loop, since services can take seconds to stop
+        if previous is not None:
+            previous.join()
+        if stop_event.is_set():
+            return
+
+        self.start_fn(stop_event, ready_event).join()
+
+    def start(self):
+        if self.is_running():
+            logging.info(f'Service {self.name} already started')
+            return
+
+        logging.info(f'Start service {self.name}')
+        stop_event = Event()
+        ready_event = Event()
+        self.stop_event = stop_event
+        self.ready_event = ready_event
+        self.thread = Thread(
+            target=self.run,
+            args=(self.thread, stop_event, ready_event),
+            name=f'{self.name}-service',
+        )
+        self.thread.start()
+
+    def wait_ready(self) -> bool:
+        if not self.is_running():
+            logging.warning(f'Service {self.name} not started')
+            return False
+
+        if not self.ready_event.wait(self.ready_timeout):
+            logging.warning(f'Service {self.name} not ready')
+            return False
+
+        return True
+
+    def stop(self):
+        if not self.is_running():
+            return
+
+        # Do not wait for the service to stop, it will be joined when it is
+        # started again or when exiting
+        logging.info(f'Stop service {self.name}')
+        self.stop_event.set()
+
+    def join(self):
+        if self.thread is None:
+            return
+
+        self.thread.join()
+        self.thread = None
+
+
+def setup_services(config: Config, context: Context):
+    # The services are only imported when started, so that the unused ones
+    # are not paid for
+    tftp_config = config.tftp
+    if tftp_config is not None:
+
+        def start_tftp(stop_event: Event, ready_event: Event):
+            from tftp import setup_tftp
+
+            return setup_tftp(tftp_config, context, stop_event, ready_event)
+
+        context.add_service(
+            Service('tftp', start_tftp, tftp_config.ready_timeout)
+        )
+
+    nfs_config = config.nfs
+    if nfs_config is not None:
+
+        def start_nfs(stop_event: Event, ready_event: Event):
+            from nfs import setup_nfs
+
+            return setup_nfs(nfs_config, context, stop_event, ready_event)
+
+        context.add_service(
+            Service('nfs', start_nfs, nfs_config.ready_timeout)
+        )
+
+    if tftp_config is not None and tftp_config.autostart:
+        context.start_service('tftp')
+    if nfs_config is not None and nfs_config.autostart:
+        context.start_service('nfs')
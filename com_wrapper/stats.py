@@ -0,0 +1,97 @@
+import time
+from typing import Any, Callable, TypeVar
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+class Timer:
+    __slots__ = ('count', 'total_ns', 'max_ns')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, ns: int):
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def format(self) -> str:
+        avg_us = self.total_ns / self.count / 1000 if self.count else 0
+        return (
+            f'n={self.count} '
+            f'avg={avg_us:.1f}us '
+            f'max={self.max_ns / 1000:.1f}us '
+            f'total={self.total_ns / 1_000_000:.1f}ms'
+        )
+
+
+class Stats:
+    # Instrumentation is applied by wrapping the hot-path functions once at
+    # setup time, so that nothing is paid when it is not enabled
+
+    def __init__(self):
+        self.start_ns = time.perf_counter_ns()
+        self.timers: dict[str, Timer] = {}
+        self.counters: dict[str, int] = {}
+
+    def timed(self, name: str, fn: F) -> F:
+        timer = self.timers.setdefault(name, Timer())
+        perf_counter_ns = time.perf_counter_ns
+
+        def wrapper(*args: Any, **kwargs: Any):
+            start_ns = perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timer.add(perf_counter_ns() - start_ns)
+
+        return wrapper  # type: ignore
+
+    def counted_calls(self, name: str, fn: F) -> F:
+        counters = self.counters
+        counters.setdefault(name, 0)
+
+        def wrapper(*args: Any, **kwargs: Any):
+            counters[name] += 1
+            return fn(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    def counted_result(
+        self,
+        name: str,
+        fn: F,
+        measure: Callable[[Any], int],
+    ) -> F:
+        counters = self.counters
+        counters.setdefault(name, 0)
+
+        def wrapper(*args: Any, **kwargs: Any):
+            result = fn(*args, **kwargs)
+            counters[name] += measure(result)
+            return result
+
+        return wrapper  # type: ignore
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            'counters': dict(self.counters),
+            'timers': {
+                k: {
+                    'count': t.count,
+                    'total_ns': t.total_ns,
+                    'max_ns': t.max_ns,
+                }
+                for k, t in self.timers.items()
+            },
+        }
+
+    def format(self) -> str:
+        elapsed_s = (time.perf_counter_ns() - self.start_ns) / 1e9
+        parts = [f'elapsed={elapsed_s:.1f}s']
+        parts.extend(f'{k}={v}' for k, v in self.counters.items())
+        parts.extend(f'{k}[{t.format()}]' for k, t in self.timers.items())
+        return ' '.join(parts)
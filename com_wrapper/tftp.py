@@ -0,0 +1,107 @@
+import logging
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+
+from config import TftpConfig
+from context import Context, replace_str_args
+
+logging.getLogger('tftpy').setLevel(logging.WARNING)
+
+
+def dyn_file_func(
+    config: TftpConfig,
+    context: Context,
+    file_path: str,
+    raddress: str,
+    rport: int,
+):
+    logging.debug(f'TFTP requested path {file_path}')
+    if file_path[0] == '/':
+        file_path = file_path[1:]
+
+    fp = Path(file_path)
+    for (
+        dst_file_path,
+        src_file_path,
+    ) in config.mounts:
+        dst_file_path = replace_str_args(context, dst_file_path)
+        src_file_path = replace_str_args(context, src_file_path)
+
+        logging.debug(f'TFTP trying {src_file_path} -> {dst_file_path}')
+
+        if src_file_path[0] == '/':
+            src_file_path = src_file_path[1:]
+
+        dp = Path(dst_file_path)
+        sp = Path(src_file_path)
+
+        if fp == sp:
+            real = dp
+        elif fp.is_relative_to(sp):
+            rp = fp.relative_to(sp)
+            real = dp.joinpath(rp)
+        else:
+            continue
+
+        logging.debug(f'TFTP resolved: {real}')
+
+        real = real.resolve()
+        if not real.is_relative_to(dp):
+            logging.debug(f'TFTP path outside of destination: {real}')
+            continue
+
+        if not real.exists():
+            logging.debug(f'TFTP path does not exist: {real}')
+            return None
+
+        return real.open('rb')
+
+    return None
+
+
+def tftp_thread_fn(
+    config: TftpConfig,
+    context: Context,
+    stop_event: Event,
+    ready_event: Event,
+):
+    import tftpy  # type: ignore
+
+    with TemporaryDirectory(prefix='tftp-') as tmp_root:
+        dyn_file_func_fn = partial(dyn_file_func, config, context)
+        server = tftpy.TftpServer(tmp_root, dyn_file_func=dyn_file_func_fn)
+        server_ip = replace_str_args(context, config.server_ip)
+        server_port = replace_str_args(context, config.server_port)
+
+        listen_t = Thread(
+            target=server.listen,
+            args=(server_ip, int(server_port)),
+            name='tftp-listen',
+        )
+        listen_t.start()
+        ready_event.set()
+
+        stop_event.wait()
+        ready_event.clear()
+        try:
+            server.stop()
+        finally:
+            listen_t.join()
+
+
+def setup_tftp(
+    config: TftpConfig,
+    context: Context,
+    stop_event: Event,
+    ready_event: Event,
+):
+    t = Thread(
+        target=tftp_thread_fn,
+        args=(config, context, stop_event, ready_event),
+        name='tftp-server',
+    )
+    t.start()
+
+    return t
@@ -5,3 +5,28 @@ def delay_us(us: int):
     end = time.perf_counter() + us / 1_000_000
     while time.perf_counter() < end:
         pass
+
+
+class StartupProfile:
+    def __init__(self):
+        self.start_ns = time.perf_counter_ns()
+        self.last_ns = self.start_ns
+        self.marks: list[tuple[str, int, int]] = []
+
+    def mark(self, name: str):
+        now_ns = time.perf_counter_ns()
+        self.marks.append((name, now_ns - self.last_ns, time.process_time_ns()))
+        self.last_ns = now_ns
+
+    def format(self) -> str:
+        # Process CPU time also covers the interpreter startup and the imports
+        # done before the profile was created
+        lines = []
+        for name, wall_ns, cpu_ns in self.marks:
+            lines.append(
+                f'{name:<16} {wall_ns / 1_000_000:8.1f}ms '
+                f'(process cpu {cpu_ns / 1_000_000:8.1f}ms)'
+            )
+        total_ms = (self.last_ns - self.start_ns) / 1_000_000
+        lines.append(f'{"total":<16} {total_ms:8.1f}ms')
+        return '\n'.join(lines)
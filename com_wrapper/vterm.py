@@ -1,7 +1,10 @@
 import ctypes
+import sys
+from array import array
 from typing import Any
 
 from vterm_bindings import (
+    VTERM_MAX_CHARS_PER_CELL,
     VTerm,
     VTermPos,
     VTermScreen,
@@ -9,21 +12,219 @@ from vterm_bindings import (
     vterm_lib,
 )
 
+# Cells are read as raw 32-bit words instead of through their ctypes fields,
+# which is a lot cheaper
+CELL_SIZE = ctypes.sizeof(VTermScreenCell)
+CELL_WORDS = CELL_SIZE // 4
+ATTRS_WORD = VTermScreenCell.attrs.offset // 4
+FG_WORD = VTermScreenCell.fg.offset // 4
+BG_WORD = VTermScreenCell.bg.offset // 4
 
-def get_vterm_stripped_row(row_data: bytearray):
+# The cell after a double-width character holds this instead of a character
+WIDE_CHAR_CONT = 0xFFFFFFFF
+SPACE = ord(' ')
+UTF32 = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
+VTERM_COLOR_INDEXED = 0x01
+VTERM_COLOR_DEFAULT_MASK = 0x06
+
+# Attribute keys pack the bold, underline, italic, blink, reverse, conceal
+# and strike attributes in the low byte, then the foreground and background
+# colors, 0 being the default attributes
+ATTRS_FLAGS_MASK = 0xFF
+COLOR_BITS = 26
+COLOR_MASK = (1 << COLOR_BITS) - 1
+FG_SHIFT = 8
+BG_SHIFT = FG_SHIFT + COLOR_BITS
+COLOR_KIND_INDEXED = 1 << 24
+COLOR_KIND_RGB = 2 << 24
+
+SGR_FLAGS = (
+    (0x01, '1'),
+    (0x06, '4'),
+    (0x08, '3'),
+    (0x10, '5'),
+    (0x20, '7'),
+    (0x40, '8'),
+    (0x80, '9'),
+)
+SGR_RESET = b'\x1b[0m'
+
+
+def get_color_key(color: int) -> int:
+    color_type = color & 0xFF
+    if color_type & VTERM_COLOR_DEFAULT_MASK:
+        return 0
+    if color_type & VTERM_COLOR_INDEXED:
+        return COLOR_KIND_INDEXED | (color >> 8) & 0xFF
+    return COLOR_KIND_RGB | color >> 8
+
+
+def get_attrs_key(attrs: int, fg: int, bg: int) -> int:
+    return (
+        attrs & ATTRS_FLAGS_MASK
+        | get_color_key(fg) << FG_SHIFT
+        | get_color_key(bg) << BG_SHIFT
+    )
+
+
+def get_color_sgr(key: int, base: int, bright_base: int) -> list[str]:
+    if key & COLOR_KIND_INDEXED:
+        idx = key & 0xFF
+        if idx < 8:
+            return [str(base + idx)]
+        if idx < 16:
+            return [str(bright_base + idx - 8)]
+        return [str(base + 8), '5', str(idx)]
+
+    if key & COLOR_KIND_RGB:
+        rgb = key & 0xFFFFFF
+        return [
+            str(base + 8),
+            '2',
+            str(rgb & 0xFF),
+            str(rgb >> 8 & 0xFF),
+            str(rgb >> 16),
+        ]
+
+    return []
+
+
+_sgr_cache: dict[int, bytes] = {}
+
+
+def get_sgr(key: int) -> bytes:
+    sgr = _sgr_cache.get(key)
+    if sgr is not None:
+        return sgr
+
+    params = ['0']
+    params.extend(p for mask, p in SGR_FLAGS if key & mask)
+    params.extend(get_color_sgr(key >> FG_SHIFT & COLOR_MASK, 30, 90))
+    params.extend(get_color_sgr(key >> BG_SHIFT & COLOR_MASK, 40, 100))
+
+    sgr = f'\x1b[{";".join(params)}m'.encode()
+    _sgr_cache[key] = sgr
+    return sgr
+
+
+class CapturedRow:
+    # Codepoints and, when capturing attributes, runs of (length, attribute
+    # key) pairs, covering the codepoints
+    __slots__ = ('chars', 'runs')
+
+    def __init__(self, chars: array, runs: array | None = None):
+        self.chars = chars
+        self.runs = runs
+
+    def text(self) -> str:
+        return self.chars.tobytes().decode(UTF32, errors='replace')
+
+    def to_bytes(self) -> bytes:
+        text = self.text()
+        if not self.runs:
+            return text.encode() + b'\n'
+
+        data = bytearray()
+        pos = 0
+        last_key = 0
+        for i in range(0, len(self.runs), 2):
+            length, key = self.runs[i], self.runs[i + 1]
+            if key != last_key:
+                data += get_sgr(key)
+                last_key = key
+            data += text[pos : pos + length].encode()
+            pos += length
+
+        if last_key:
+            data += SGR_RESET
+        data += b'\n'
+        return bytes(data)
+
+
+def get_stripped_len(chars: array) -> int:
     # Strip ending NULLs and spaces
-    row_data = row_data.replace(b'\x00', b' ')
-    row_data = row_data.rstrip(b' ')
-    row_data.append(ord('\n'))
-    return row_data
+    end = len(chars)
+    while end and chars[end - 1] in (0, SPACE):
+        end -= 1
+    return end
 
 
-def get_vterm_row_data(cols: int, cells: Any):
-    data = bytearray()
-    for i in range(cols):
-        data.append(cells[i].chars[0])
+def capture_words(words: array) -> CapturedRow:
+    chars = words[0::CELL_WORDS]
+    if WIDE_CHAR_CONT in chars:
+        chars = array('I', (c for c in chars if c != WIDE_CHAR_CONT))
+    del chars[get_stripped_len(chars) :]
 
-    return data
+    if 0 in chars:
+        for i, c in enumerate(chars):
+            if not c:
+                chars[i] = SPACE
+
+    return CapturedRow(chars)
+
+
+def capture_words_full(words: array, with_attrs: bool) -> CapturedRow:
+    chars = array('I')
+    runs = array('Q') if with_attrs else None
+    run_len = 0
+    run_key = 0
+
+    for i in range(0, len(words), CELL_WORDS):
+        c = words[i]
+        if c == WIDE_CHAR_CONT:
+            continue
+
+        start = len(chars)
+        chars.append(c or SPACE)
+        for j in range(i + 1, i + VTERM_MAX_CHARS_PER_CELL):
+            if not words[j]:
+                break
+            chars.append(words[j])
+
+        if runs is None:
+            continue
+
+        key = 0
+        if c:
+            key = get_attrs_key(
+                words[i + ATTRS_WORD],
+                words[i + FG_WORD],
+                words[i + BG_WORD],
+            )
+        if key != run_key and run_len:
+            runs.extend((run_len, run_key))
+            run_len = 0
+        run_key = key
+        run_len += len(chars) - start
+
+    end = get_stripped_len(chars)
+    del chars[end:]
+
+    if runs is not None:
+        runs.extend((run_len, run_key))
+
+        # Cut the runs to the stripped characters
+        pos = 0
+        for i in range(0, len(runs), 2):
+            if pos + runs[i] >= end:
+                runs[i] = end - pos
+                del runs[i + 2 if runs[i] else i :]
+                break
+            pos += runs[i]
+
+    return CapturedRow(chars, runs)
+
+
+def capture_cells(cols: int, cells: Any, with_attrs: bool) -> CapturedRow:
+    address = ctypes.cast(cells, ctypes.c_void_p).value
+    words = array('I', ctypes.string_at(address, cols * CELL_SIZE))
+
+    # Combining characters follow the first character of the cell, which
+    # is rare enough for rows without any to take a fast path
+    if with_attrs or any(words[1::CELL_WORDS]):
+        return capture_words_full(words, with_attrs)
+    return capture_words(words)
 
 
 def get_vterm_size(vterm: VTerm):
@@ -33,15 +234,18 @@ def get_vterm_size(vterm: VTerm):
     return rows.value, cols.value
 
 
-def get_vterm_screen_data(vterm: VTerm, vterm_screen: VTermScreen):
+def get_vterm_screen_data(
+    vterm: VTerm,
+    vterm_screen: VTermScreen,
+    with_attrs: bool = False,
+):
     rows, cols = get_vterm_size(vterm)
     pos = VTermPos()
-    cell = VTermScreenCell()
+    cells = (VTermScreenCell * cols)()
+    cell_ptrs = [ctypes.pointer(cell) for cell in cells]
 
     data = bytearray()
     for row in range(rows):
-        row_data = bytearray()
-
         pos.row = row
         for col in range(cols):
             pos.col = col
@@ -49,11 +253,9 @@ def get_vterm_screen_data(vterm: VTerm, vterm_screen: VTermScreen):
             vterm_lib.vterm_screen_get_cell(
                 vterm_screen,
                 pos,
-                ctypes.byref(cell),
+                cell_ptrs[col],
             )
-            row_data.append(cell.chars[0])
 
-        stripped_row_data = get_vterm_stripped_row(row_data)
-        data.extend(stripped_row_data)
+        data += capture_cells(cols, cells, with_attrs).to_bytes()
 
     return data
@@ -86,11 +86,24 @@ VTerm = ctypes.c_void_p
 VTermState = ctypes.c_void_p
 VTermScreen = ctypes.c_void_p
 
-vterm_lib = ctypes.CDLL(find_library('vterm') or 'libvterm.so')
+
+def load_vterm_lib():
+    # find_library() spawns ldconfig and the compiler, only fall back to it
+    # if the library cannot be loaded by its soname
+    try:
+        return ctypes.CDLL('libvterm.so.0')
+    except OSError:
+        return ctypes.CDLL(find_library('vterm') or 'libvterm.so')
+
+
+vterm_lib = load_vterm_lib()
 
 vterm_lib.vterm_new.argtypes = (ctypes.c_int, ctypes.c_int)
 vterm_lib.vterm_new.restype = VTerm
 
+vterm_lib.vterm_set_utf8.argtypes = (VTerm, ctypes.c_int)
+vterm_lib.vterm_set_utf8.restype = None
+
 vterm_lib.vterm_obtain_screen.argtypes = (VTerm,)
 vterm_lib.vterm_obtain_screen.restype = VTermScreen
 
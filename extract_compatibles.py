@@ -1,46 +1,280 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import glob
+import json
+import os
 import sys
-from typing import Any, Set
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from typing import (
+    Any,
+    Container,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
 
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore
+
 YamlNode = Any
 
+CACHE_VERSION = 2
+CACHE_DIR = (
+    Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache'))
+    / 'work-utils'
+)
+DEFAULT_CACHE_PATH = CACHE_DIR / 'extract_compatibles.json'
+
+
+def iter_strings(node: YamlNode) -> Iterator[str]:
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if isinstance(n, str):
+            yield n
+        elif isinstance(n, list):
+            stack.extend(reversed(n))
+        elif isinstance(n, dict):
+            stack.extend(reversed(n.values()))
+
+
+def iter_key_values(
+    node: YamlNode,
+    keys: Container[str],
+    descend: bool = False,
+) -> Iterator[YamlNode]:
+    # Walk with an explicit stack of (key, node) pairs, pushed in reverse so
+    # that values are yielded in document order, without recursing
+    stack: List[Tuple[Any, YamlNode]] = [(None, node)]
+    while stack:
+        key, n = stack.pop()
+        if key is not None and key in keys:
+            yield n
+            if not descend:
+                continue
+        if isinstance(n, dict):
+            stack.extend(reversed(n.items()))
+        elif isinstance(n, list):
+            stack.extend((None, item) for item in reversed(n))
+
+
+def iter_key_strings(node: YamlNode, keys: Container[str]) -> Iterator[str]:
+    for value in iter_key_values(node, keys):
+        yield from iter_strings(value)
+
+
+def iter_key_names(node: YamlNode, keys: Container[str]) -> Iterator[str]:
+    for value in iter_key_values(node, keys, descend=True):
+        if isinstance(value, dict):
+            yield from (k for k in value if isinstance(k, str))
+
+
+def iter_compatibles(node: YamlNode) -> Iterator[str]:
+    return iter_key_strings(node, ('compatible',))
+
 
 def collect_strings(node: YamlNode, out: Set[str]) -> None:
-    if isinstance(node, str):
-        out.add(node)
-    elif isinstance(node, list):
-        for item in node:
-            collect_strings(item, out)
-    elif isinstance(node, dict):
-        for value in node.values():
-            collect_strings(value, out)
+    out.update(iter_strings(node))
 
 
 def find_compatible_nodes(node: YamlNode, out: Set[str]) -> None:
-    if isinstance(node, dict):
-        for key, value in node.items():
-            if key == 'compatible':
-                collect_strings(value, out)
-            else:
-                find_compatible_nodes(value, out)
-    elif isinstance(node, list):
-        for item in node:
-            find_compatible_nodes(item, out)
+    out.update(iter_compatibles(node))
+
+
+class KeyQuery(NamedTuple):
+    values: Tuple[str, ...] = ('compatible',)
+    names: Tuple[str, ...] = ()
+
+    def cache_key(self) -> str:
+        return json.dumps([self.values, self.names])
+
+    def iter_results(self, node: YamlNode) -> Iterator[str]:
+        if self.values:
+            yield from iter_key_strings(node, self.values)
+        if self.names:
+            yield from iter_key_names(node, self.names)
+
+
+def find_yaml_files(patterns: List[str]) -> List[Path]:
+    out: Dict[Path, None] = {}
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = [p for p in path.rglob('*.yaml') if p.is_file()]
+        elif glob.has_magic(pattern):
+            matches = [Path(p) for p in glob.glob(pattern, recursive=True)]
+        else:
+            matches = [path]
+        for p in sorted(matches):
+            out[p.resolve()] = None
+    return list(out)
+
+
+def extract_file(
+    path: Path,
+    query: KeyQuery = KeyQuery(),
+) -> Tuple[Path, Optional[List[str]]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = yaml.load(f, Loader=SafeLoader)
+    except (OSError, yaml.YAMLError) as e:
+        print(f'{path}: {e}', file=sys.stderr)
+        return path, None
+
+    return path, sorted(set(query.iter_results(data)))
+
+
+def load_cache(
+    cache_path: Path,
+    version: int = CACHE_VERSION,
+) -> Dict[str, Any]:
+    try:
+        cache = json.loads(cache_path.read_text())
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != version:
+        return {}
+    return cache.get('files', {})
+
+
+def save_cache(
+    cache_path: Path,
+    files: Dict[str, Any],
+    version: int = CACHE_VERSION,
+) -> None:
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps({'version': version, 'files': files}))
+    tmp_path.replace(cache_path)
+
+
+def extract_files(
+    paths: List[Path],
+    cache_path: Optional[Path] = None,
+    jobs: Optional[int] = None,
+    query: KeyQuery = KeyQuery(),
+) -> Dict[Path, List[str]]:
+    cache = load_cache(cache_path) if cache_path is not None else {}
+    query_key = query.cache_key()
+
+    out: Dict[Path, List[str]] = {}
+    mtimes: Dict[Path, int] = {}
+    stale: List[Path] = []
+    for path in paths:
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError as e:
+            print(f'{path}: {e}', file=sys.stderr)
+            continue
+
+        entry = cache.get(str(path))
+        if entry is not None and entry['mtime'] != mtime:
+            del cache[str(path)]
+            entry = None
+        if entry is not None and query_key in entry['results']:
+            out[path] = entry['results'][query_key]
+        else:
+            mtimes[path] = mtime
+            stale.append(path)
+
+    if len(stale) > 1 and jobs != 1:
+        workers = jobs or os.cpu_count() or 1
+        chunksize = max(1, len(stale) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    extract_file,
+                    stale,
+                    repeat(query),
+                    chunksize=chunksize,
+                )
+            )
+    else:
+        results = [extract_file(path, query) for path in stale]
+
+    for path, strings in results:
+        if strings is None:
+            continue
+        out[path] = strings
+        entry = cache.setdefault(
+            str(path),
+            {'mtime': mtimes[path], 'results': {}},
+        )
+        entry['results'][query_key] = strings
+
+    if cache_path is not None and stale:
+        save_cache(cache_path, cache)
+
+    return {path: out[path] for path in paths if path in out}
 
 
 def main() -> None:
-    if len(sys.argv) != 2:
-        sys.exit(1)
+    parser = ArgumentParser(
+        description='Extract the compatibles, or the values of other keys, '
+        'from device-tree binding schemas'
+    )
+    parser.add_argument(
+        'paths',
+        nargs='+',
+        help='Binding files, directories or globs',
+    )
+    parser.add_argument(
+        '-k',
+        '--key',
+        action='append',
+        default=[],
+        help='Extract the strings under KEY, defaults to compatible',
+    )
+    parser.add_argument(
+        '-n',
+        '--names-of',
+        metavar='KEY',
+        action='append',
+        default=[],
+        help='Extract the names of the mapping under KEY, eg: properties',
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        help='Number of parallel workers, defaults to the number of CPUs',
+    )
+    parser.add_argument(
+        '--cache',
+        type=Path,
+        default=DEFAULT_CACHE_PATH,
+        help=f'Path of the per-file cache, defaults to {DEFAULT_CACHE_PATH}',
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Do not read or write the per-file cache',
+    )
+    args = parser.parse_args()
 
-    with open(sys.argv[1], 'r', encoding='utf-8') as f:
-        data = yaml.safe_load(f)
+    paths = find_yaml_files(args.paths)
+    cache_path = None if args.no_cache else args.cache
+    if args.key or args.names_of:
+        query = KeyQuery(tuple(args.key), tuple(args.names_of))
+    else:
+        query = KeyQuery()
+    file_results = extract_files(paths, cache_path, args.jobs, query)
 
     results: Set[str] = set()
-    find_compatible_nodes(data, results)
+    for strings in file_results.values():
+        results.update(strings)
 
     for s in sorted(results):
         print(s)
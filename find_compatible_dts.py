@@ -1,9 +1,26 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import hashlib
+import re
 import sys
+from argparse import ArgumentParser
 from pathlib import Path
-from typing import Dict, List, Set
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from extract_compatibles import (
+    CACHE_DIR,
+    DEFAULT_CACHE_PATH,
+    extract_files,
+    find_yaml_files,
+    load_cache,
+    save_cache,
+)
+
+DTS_CACHE_VERSION = 1
+
+COMPATIBLE_RE = re.compile(r'\bcompatible\s*=\s*([^;]*);')
+STRING_RE = re.compile(r'"([^"]*)"')
 
 
 def find_all_dts_files(root: Path) -> List[Path]:
@@ -19,6 +36,11 @@ def find_all_dts_files(root: Path) -> List[Path]:
     return out
 
 
+def get_dts_cache_path(kernel: Path) -> Path:
+    digest = hashlib.sha1(str(kernel).encode()).hexdigest()[:16]
+    return CACHE_DIR / f'find_compatible_dts-{digest}.json'
+
+
 def find_matching_files(files: List[Path], compatibles: List[str]) -> Set[Path]:
     quoted = [f'"{c}"' for c in compatibles]
     out: Set[Path] = set()
@@ -32,24 +54,76 @@ def find_matching_files(files: List[Path], compatibles: List[str]) -> Set[Path]:
     return out
 
 
+def read_dts_text(path: Path) -> str:
+    try:
+        return path.read_text(encoding='utf-8', errors='ignore')
+    except Exception:
+        return ''
+
+
+def parse_includes(path: Path, text: str) -> Set[Path]:
+    incs: Set[Path] = set()
+    for line in text.splitlines():
+        s = line.strip()
+        if s.startswith('#include'):
+            parts = s.split('"')
+            if len(parts) >= 2:
+                inc = (path.parent / parts[1]).resolve()
+                incs.add(inc)
+    return incs
+
+
+def parse_compatibles(text: str) -> Set[str]:
+    compats: Set[str] = set()
+    for value in COMPATIBLE_RE.findall(text):
+        compats.update(STRING_RE.findall(value))
+    return compats
+
+
 def collect_includes(files: List[Path]) -> Dict[Path, Set[Path]]:
-    m: Dict[Path, Set[Path]] = {}
+    return {path: parse_includes(path, read_dts_text(path)) for path in files}
+
+
+def collect_compatibles(files: List[Path]) -> Dict[Path, Set[str]]:
+    return {path: parse_compatibles(read_dts_text(path)) for path in files}
+
+
+def scan_dts_files(
+    files: List[Path],
+    cache_path: Optional[Path] = None,
+) -> Tuple[Dict[Path, Set[Path]], Dict[Path, Set[str]]]:
+    cache = {}
+    if cache_path is not None:
+        cache = load_cache(cache_path, DTS_CACHE_VERSION)
+
+    incmap: Dict[Path, Set[Path]] = {}
+    compatmap: Dict[Path, Set[str]] = {}
+    new_cache: Dict[str, Any] = {}
+    changed = len(cache) != len(files)
     for path in files:
         try:
-            text = path.read_text(encoding='utf-8', errors='ignore')
-        except Exception:
-            m[path] = set()
-            continue
-        incs: Set[Path] = set()
-        for line in text.splitlines():
-            s = line.strip()
-            if s.startswith('#include'):
-                parts = s.split('"')
-                if len(parts) >= 2:
-                    inc = (path.parent / parts[1]).resolve()
-                    incs.add(inc)
-        m[path] = incs
-    return m
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            mtime = 0
+
+        entry = cache.get(str(path))
+        if entry is None or entry['mtime'] != mtime:
+            text = read_dts_text(path)
+            entry = {
+                'mtime': mtime,
+                'includes': sorted(map(str, parse_includes(path, text))),
+                'compatibles': sorted(parse_compatibles(text)),
+            }
+            changed = True
+
+        new_cache[str(path)] = entry
+        incmap[path] = set(map(Path, entry['includes']))
+        compatmap[path] = set(entry['compatibles'])
+
+    if cache_path is not None and changed:
+        save_cache(cache_path, new_cache, DTS_CACHE_VERSION)
+
+    return incmap, compatmap
 
 
 def find_roots(incmap: Dict[Path, Set[Path]]) -> Set[Path]:
@@ -85,16 +159,133 @@ def reachable(
     return out
 
 
+def forward_closure(
+    start: Path,
+    incmap: Dict[Path, Set[Path]],
+    cache: Dict[Path, FrozenSet[Path]],
+) -> FrozenSet[Path]:
+    # Post-order walk, so that the closure of every visited file is cached
+    # and shared between all the roots including it
+    if start in cache:
+        return cache[start]
+
+    stack = [(start, iter(incmap.get(start, set())))]
+    on_stack = {start}
+    while stack:
+        n, it = stack[-1]
+        child = next(it, None)
+        if child is None:
+            stack.pop()
+            on_stack.discard(n)
+            out: Set[Path] = set()
+            for inc in incmap.get(n, set()):
+                out.add(inc)
+                out.update(cache.get(inc, frozenset()))
+            cache[n] = frozenset(out)
+            continue
+        if child in cache or child in on_stack:
+            continue
+        on_stack.add(child)
+        stack.append((child, iter(incmap.get(child, set()))))
+
+    return cache[start]
+
+
+def closure_compatibles(
+    root: Path,
+    closure: Iterable[Path],
+    compatmap: Dict[Path, Set[str]],
+) -> Set[str]:
+    out = set(compatmap.get(root, set()))
+    for path in closure:
+        out.update(compatmap.get(path, set()))
+    return out
+
+
+def print_closure(
+    root: Path,
+    closure: FrozenSet[Path],
+    compatmap: Dict[Path, Set[str]],
+) -> None:
+    print(f'{root}:')
+    print('\tincludes:')
+    for p in sorted(closure):
+        print(f'\t\t{p}')
+    print('\tcompatibles:')
+    for c in sorted(closure_compatibles(root, closure, compatmap)):
+        print(f'\t\t{c}')
+
+
 def main() -> None:
-    if len(sys.argv) < 3:
+    parser = ArgumentParser(
+        description='Find the top-level .dts files including the given '
+        'compatibles, or the includes and compatibles reaching a .dts'
+    )
+    parser.add_argument('kernel', help='Path to the kernel tree')
+    parser.add_argument(
+        'queries',
+        nargs='*',
+        help='Compatibles to look up, or .dts files with --dts',
+    )
+    parser.add_argument(
+        '-b',
+        '--binding',
+        action='append',
+        default=[],
+        help='Also look up the compatibles of the given binding files, '
+        'directories or globs',
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Do not read or write the include graph and binding caches',
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        '--dts',
+        action='store_true',
+        help='Print the included files and compatibles of the given .dts',
+    )
+    mode.add_argument(
+        '--all',
+        action='store_true',
+        help='Print the included files and compatibles of all .dts roots',
+    )
+    args = parser.parse_intermixed_args()
+
+    if not args.all and not args.queries and not args.binding:
+        parser.print_usage()
         sys.exit(1)
 
-    kernel = Path(sys.argv[1]).resolve()
-    compatibles = sys.argv[2:]
+    kernel = Path(args.kernel).resolve()
 
     files = find_all_dts_files(kernel)
-    matches = find_matching_files(files, compatibles)
-    incmap = collect_includes(files)
+    dts_cache_path = None if args.no_cache else get_dts_cache_path(kernel)
+    incmap, compatmap = scan_dts_files(files, dts_cache_path)
+
+    if args.dts or args.all:
+        if args.all:
+            dts_files = sorted(find_roots(incmap))
+        else:
+            dts_files = [Path(q).resolve() for q in args.queries]
+
+        cache: Dict[Path, FrozenSet[Path]] = {}
+        for root in dts_files:
+            if root not in incmap:
+                print(f'{root}: not found', file=sys.stderr)
+                continue
+            print_closure(root, forward_closure(root, incmap, cache), compatmap)
+        return
+
+    compatibles: Dict[str, None] = dict.fromkeys(args.queries)
+    if args.binding:
+        binding_files = find_yaml_files(args.binding)
+        cache_path = None if args.no_cache else DEFAULT_CACHE_PATH
+        results = extract_files(binding_files, cache_path)
+        for strings in results.values():
+            compatibles.update(dict.fromkeys(strings))
+
+    matches = find_matching_files(files, list(compatibles))
     roots = find_roots(incmap)
     rev = reverse_graph(incmap)
     tops = reachable(matches, rev, roots)
@@ -1,50 +1,264 @@
 #!/usr/bin/env python3
+from __future__ import annotations
 
+import json
 import sys
-from collections import OrderedDict
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+)
 
-text = sys.stdin.read().splitlines()
-versions: OrderedDict[str, list[str]] = OrderedDict()
-current = None
-buffer: list[str] = []
+# Version -> unique items, dicts keep insertion order and give O(1) lookups
+Notes = Dict[str, Dict[str, None]]
 
+META_REF_PREFIX = 'refs/meta/'
+CACHE_NAME = 'gather-notes-cache.json'
+CACHE_VERSION = 1
+
+
+def is_empty_item(item: str) -> bool:
+    return item.strip().lower() == '* no changes'
+
+
+def parse_notes(
+    lines: Iterable[str],
+) -> Iterator[Tuple[str, Optional[str]]]:
+    current: Optional[str] = None
+    buffer: List[str] = []
+
+    def flush_buffer() -> Optional[Tuple[str, str]]:
+        if not buffer or current is None:
+            return None
 
-def flush_buffer():
-    if buffer and current:
         item = '\n'.join(buffer).rstrip()
+        buffer.clear()
+
+        if is_empty_item(item):
+            return None
+
+        return current, item
+
+    for line in lines:
+        line = line.rstrip()
+        if not line.strip():
+            continue
+
+        if line.endswith(':'):  # version header
+            entry = flush_buffer()
+            if entry is not None:
+                yield entry
+            current = line[:-1].strip()
+            yield current, None
+            continue
+
+        if current is None:
+            continue
+
+        if line.lstrip().startswith('*'):  # start of new bullet
+            entry = flush_buffer()
+            if entry is not None:
+                yield entry
+        buffer.append(line)
+
+    entry = flush_buffer()
+    if entry is not None:
+        yield entry
+
+
+def iter_unique_notes(
+    lines: Iterable[str],
+    notes: Optional[Notes] = None,
+) -> Iterator[Tuple[str, str]]:
+    if notes is None:
+        notes = {}
+
+    for version, item in parse_notes(lines):
+        items = notes.setdefault(version, {})
+        if item is None or item in items:
+            continue
+
+        items[item] = None
+        yield version, item
+
+
+def gather_notes(lines: Iterable[str]) -> Notes:
+    notes: Notes = {}
+    for _ in iter_unique_notes(lines, notes):
+        pass
+    return notes
+
 
-        if item.strip().lower() in ('* no changes'):
-            buffer.clear()
+def print_notes(notes: Notes, out: TextIO = sys.stdout) -> None:
+    for i, (version, items) in enumerate(notes.items()):
+        print(f'{version}:', file=out)
+        for item in items:
+            print(item, file=out)
+        if i < len(notes) - 1:
+            print(file=out)
+
+
+def print_notes_incremental(
+    lines: Iterable[str],
+    out: TextIO = sys.stdout,
+) -> None:
+    last_version = None
+    for version, item in iter_unique_notes(lines):
+        if version != last_version:
+            if last_version is not None:
+                print(file=out)
+            print(f'{version}:', file=out)
+            last_version = version
+        print(item, file=out, flush=True)
+
+
+def get_change_id(message: str) -> Optional[str]:
+    for line in message.splitlines():
+        if line.startswith('Change-Id:'):
+            parts = line.split()
+            return parts[1] if len(parts) > 1 else None
+    return None
+
+
+class MetaNotesReader:
+    def __init__(self, repo_path: str = '.'):
+        # Imported lazily so that reading from stdin does not need gitpython
+        import git
+
+        self.repo = git.Repo(repo_path, search_parent_directories=True)
+        self.cache_path = Path(self.repo.git_dir) / CACHE_NAME
+        self.cache = self.load_cache()
+        self.cache_changed = False
+
+        # Change-Id -> meta ref OID, from a single ref listing
+        self.meta_refs: Dict[str, str] = {}
+        refs = self.repo.git.for_each_ref(
+            '--format=%(objectname) %(refname)',
+            META_REF_PREFIX,
+        )
+        for line in refs.splitlines():
+            oid, ref = line.split(' ', 1)
+            self.meta_refs[ref[len(META_REF_PREFIX) :]] = oid
+
+    def load_cache(self) -> Dict[str, Any]:
+        try:
+            cache = json.loads(self.cache_path.read_text())
+        except (OSError, ValueError):
+            cache = {}
+        if cache.get('version') != CACHE_VERSION:
+            cache = {'version': CACHE_VERSION, 'commits': {}, 'meta': {}}
+        return cache
+
+    def save_cache(self) -> None:
+        if not self.cache_changed:
             return
 
-        if item not in versions[current]:
-            versions[current].append(item)
-        buffer.clear()
+        tmp_path = self.cache_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.cache))
+        tmp_path.replace(self.cache_path)
+        self.cache_changed = False
+
+    def rev_list(self, commitish: str) -> List[str]:
+        if '..' in commitish:
+            out = self.repo.git.rev_list('--reverse', commitish)
+        else:
+            out = self.repo.git.rev_list('--no-walk', commitish)
+        return out.splitlines()
+
+    def read_object(self, oid: str) -> str:
+        # Served by the persistent cat-file --batch process of gitpython
+        stream = self.repo.odb.stream(bytes.fromhex(oid))
+        return stream.read().decode('utf-8', errors='replace')
+
+    def commit_change_id(self, commit: str) -> Optional[str]:
+        commits = self.cache['commits']
+        if commit not in commits:
+            message = self.read_object(commit).split('\n\n', 1)[-1]
+            commits[commit] = get_change_id(message)
+            self.cache_changed = True
+        return commits[commit]
+
+    def meta_content(self, change_id: str) -> Optional[str]:
+        oid = self.meta_refs.get(change_id)
+        if oid is None:
+            return None
+
+        meta = self.cache['meta']
+        entry = meta.get(change_id)
+        if entry is None or entry['oid'] != oid:
+            entry = {'oid': oid, 'content': self.read_object(oid)}
+            meta[change_id] = entry
+            self.cache_changed = True
+        return entry['content']
+
+    def iter_lines(self, commitishes: Iterable[str]) -> Iterator[str]:
+        for commitish in commitishes:
+            for commit in self.rev_list(commitish):
+                change_id = self.commit_change_id(commit)
+                if not change_id:
+                    continue
+
+                content = self.meta_content(change_id)
+                if not content:
+                    continue
+
+                yield from content.splitlines()
+
+        self.save_cache()
 
+    def close(self) -> None:
+        self.save_cache()
+        self.repo.close()
 
-for line in text:
-    line = line.rstrip()
-    if not line.strip():
-        continue
 
-    if line.endswith(':'):  # version header
-        flush_buffer()
-        current = line[:-1].strip()
-        versions.setdefault(current, [])
-        continue
+def main() -> None:
+    parser = ArgumentParser(
+        description='Gather the per-version notes read from stdin, '
+        'merging duplicate versions and items'
+    )
+    parser.add_argument(
+        'commits',
+        nargs='*',
+        help='Commits or commit ranges to read the meta notes of, read the '
+        'notes from stdin if not given',
+    )
+    parser.add_argument(
+        '-C',
+        '--repo',
+        default='.',
+        help='Path of the git repository, defaults to the current directory',
+    )
+    parser.add_argument(
+        '-i',
+        '--incremental',
+        action='store_true',
+        help='Print every new item as soon as it is read, repeating the '
+        'version header whenever the version changes',
+    )
+    args = parser.parse_args()
 
-    if current is None:
-        continue
+    reader = None
+    lines: Iterable[str] = sys.stdin
+    if args.commits:
+        reader = MetaNotesReader(args.repo)
+        lines = reader.iter_lines(args.commits)
 
-    if line.lstrip().startswith('*'):  # start of new bullet
-        flush_buffer()
-    buffer.append(line)
+    try:
+        if args.incremental:
+            print_notes_incremental(lines)
+        else:
+            print_notes(gather_notes(lines))
+    finally:
+        if reader is not None:
+            reader.close()
 
-flush_buffer()
 
-for i, (version, items) in enumerate(versions.items()):
-    print(f'{version}:')
-    for item in items:
-        print(item)
-    if i < len(versions) - 1:
-        print()
+if __name__ == '__main__':
+    main()